@@ -2,6 +2,7 @@ from flask import Flask
 from flask_cors import CORS
 from config import Config
 from routes import api
+from services.model_service import model_manager, configure_inference_threads
 
 def create_app():
     app = Flask(__name__)
@@ -12,6 +13,12 @@ def create_app():
     
     # Registrar Rutas
     app.register_blueprint(api, url_prefix='/api')
+
+    # Hilos de TF/torch de este proceso, antes de que se inicialice el runtime
+    configure_inference_threads(Config.INFERENCE_THREADS)
+
+    # Precarga + warm-up en segundo plano (ver /api/ready)
+    model_manager.start_preload(Config.PRELOAD_MODELS)
     
     return app
 
@@ -21,9 +21,129 @@ class Config:
     MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
     MONGO_DB = os.getenv('MONGO_DB', 'tomato_classifier')
     
+    # Escritura write-behind de predicciones (insert_many por tamaño o tiempo)
+    DB_WRITE_BEHIND = os.getenv('DB_WRITE_BEHIND', 'true').lower() == 'true'
+    DB_WRITE_QUEUE_MAX = int(os.getenv('DB_WRITE_QUEUE_MAX', 10000))
+    DB_FLUSH_BATCH_SIZE = int(os.getenv('DB_FLUSH_BATCH_SIZE', 100))
+    DB_FLUSH_INTERVAL_MS = float(os.getenv('DB_FLUSH_INTERVAL_MS', 200))
+    # Cola llena: 'block' (espera DB_ENQUEUE_TIMEOUT_S y descarta), 'drop_newest' o 'drop_oldest'
+    DB_QUEUE_FULL_POLICY = os.getenv('DB_QUEUE_FULL_POLICY', 'block')
+    DB_ENQUEUE_TIMEOUT_S = float(os.getenv('DB_ENQUEUE_TIMEOUT_S', 1.0))
+
+    # Spool local (JSONL) cuando MongoDB no está disponible + reconexión con backoff
+    DB_SPOOL_PATH = os.getenv('DB_SPOOL_PATH', str(BASE_DIR / 'spool' / 'predictions.jsonl'))
+    DB_SPOOL_FSYNC = os.getenv('DB_SPOOL_FSYNC', 'true').lower() == 'true'
+    DB_RECONNECT_MIN_S = float(os.getenv('DB_RECONNECT_MIN_S', 1))
+    DB_RECONNECT_MAX_S = float(os.getenv('DB_RECONNECT_MAX_S', 60))
+
+    # /stats se sirve de contadores en memoria; cada cuánto se reconcilian con Mongo
+    DB_STATS_RECONCILE_S = float(os.getenv('DB_STATS_RECONCILE_S', 300))
+
+    # Avisar en el log (una vez por forma de consulta) si el historial no usa índice
+    DB_CHECK_QUERY_PLANS = os.getenv('DB_CHECK_QUERY_PLANS', 'true').lower() == 'true'
+
+    # /predictions: tope de registros por página (aunque se pida más)
+    PREDICTIONS_MAX_PAGE_SIZE = int(os.getenv('PREDICTIONS_MAX_PAGE_SIZE', 100))
+
+    # /predictions/stream (SSE): buffer por suscriptor, máximo de conexiones y heartbeat.
+    # Cada stream ocupa un hilo del worker (gthread) mientras dura la conexión:
+    # el máximo nunca pasa de GUNICORN_THREADS - 1 para que quede un hilo libre.
+    GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 2))
+    SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', 100))
+    SSE_MAX_SUBSCRIBERS = max(0, min(int(os.getenv('SSE_MAX_SUBSCRIBERS', GUNICORN_THREADS - 1)),
+                                     GUNICORN_THREADS - 1))
+    SSE_HEARTBEAT_S = float(os.getenv('SSE_HEARTBEAT_S', 15))
+    # Reconexión con Last-Event-ID: registros a reenviar como máximo (si hay más, evento reset)
+    SSE_REPLAY_MAX = int(os.getenv('SSE_REPLAY_MAX', 1000))
+    
     # Configuración de archivos
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    # Tope del cuerpo de la petición: REQUEST_MAX_MB en general y BATCH_REQUEST_MAX_MB
+    # en /classify/batch (decenas de fotos de móvil). Flask aplica el mayor y
+    # routes.limit_request_size el que corresponde a cada ruta.
+    REQUEST_MAX_MB = float(os.getenv('REQUEST_MAX_MB', 16))
+    BATCH_REQUEST_MAX_MB = float(os.getenv('BATCH_REQUEST_MAX_MB', 1024))
+    MAX_CONTENT_LENGTH = int(max(REQUEST_MAX_MB, BATCH_REQUEST_MAX_MB) * 1024 * 1024)
+    # Tope por archivo dentro de /classify/batch
+    MAX_FILE_MB = float(os.getenv('MAX_FILE_MB', 16))
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'gif'}
+    # La inferencia decodifica desde memoria; el original se guarda en segundo plano
+    PERSIST_UPLOADS = os.getenv('PERSIST_UPLOADS', 'true').lower() == 'true'
     
     # Ruta de modelos disponible para la app (opcional, por si la necesitas en otro lado)
-    MODELS_PATH = MODELS_DIR
\ No newline at end of file
+    MODELS_PATH = MODELS_DIR
+
+    # Presupuesto de RAM para modelos cargados (0 = sin límite). Al superarlo
+    # se descarga el modelo usado hace más tiempo (LRU), incluido YOLO.
+    MODEL_MEMORY_BUDGET_MB = float(os.getenv('MODEL_MEMORY_BUDGET_MB', 1024))
+
+    # Modelos a precargar (y calentar) en segundo plano al crear la app.
+    # Lista separada por comas, p.ej. "mobilenetv2,resnet50,yolo". Vacío = lazy loading puro.
+    PRELOAD_MODELS = [m.strip() for m in os.getenv('PRELOAD_MODELS', '').split(',') if m.strip()]
+
+    # Hilos de inferencia por worker (0 = dejar el valor por defecto de TF/torch)
+    INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', 0))
+
+    # Carga de modelos: tiempo máximo de espera y pausa tras un fallo
+    MODEL_LOAD_TIMEOUT_S = float(os.getenv('MODEL_LOAD_TIMEOUT_S', 300))
+    MODEL_LOAD_BACKOFF_S = float(os.getenv('MODEL_LOAD_BACKOFF_S', 30))
+
+    # Backend ONNX ("backend": "onnx" en el config.json del modelo)
+    ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', 0))
+
+    # Micro-batching de inferencia (agrupa peticiones concurrentes de /classify)
+    BATCHING_ENABLED = os.getenv('BATCHING_ENABLED', 'true').lower() == 'true'
+    BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 16))
+    BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', 10))
+    BATCH_MAX_QUEUE = int(os.getenv('BATCH_MAX_QUEUE', 256))
+    # Espera máxima de una petición por su resultado (no bloquear el hilo para siempre)
+    BATCH_SUBMIT_TIMEOUT_S = float(os.getenv('BATCH_SUBMIT_TIMEOUT_S', 30))
+
+    # /compare: cuántos modelos pueden ejecutarse a la vez (TF libera el GIL)
+    COMPARE_MAX_WORKERS = int(os.getenv('COMPARE_MAX_WORKERS', 3))
+
+    # Caché de resultados por SHA-256 del archivo subido
+    RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 2048))
+    # Directorio del nivel en disco (vacío = solo memoria)
+    RESULT_CACHE_DISK_DIR = os.getenv('RESULT_CACHE_DISK_DIR', '')
+
+    # Caché de casi-duplicados por hash perceptual (opt-in). Distancia de
+    # Hamming máxima sobre 64 bits; hasta 11 la búsqueda sigue siendo barata.
+    NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', 'false').lower() == 'true'
+    NEAR_DUP_MAX_DISTANCE = int(os.getenv('NEAR_DUP_MAX_DISTANCE', 4))
+    # Cada entrada cuesta ~0.75 KB por worker (hash, top-k compacto y 4 buckets),
+    # fuera de MODEL_MEMORY_BUDGET_MB: 20000 entradas ≈ 15 MB, 200000 ≈ 150 MB.
+    NEAR_DUP_MAX_ENTRIES = int(os.getenv('NEAR_DUP_MAX_ENTRIES', 20000))
+
+    # Calidad JPEG de la imagen segmentada que se devuelve en /segment
+    SEG_JPEG_QUALITY = int(os.getenv('SEG_JPEG_QUALITY', 90))
+
+    # Render de la superposición bajo demanda (al pedir /image/seg_<nombre>).
+    # false = renderizar en la propia petición de /segment
+    SEG_LAZY_RENDER = os.getenv('SEG_LAZY_RENDER', 'true').lower() == 'true'
+    # Tamaños de vista previa (?size=) que se renderizan y cachean; otros valores
+    # se redondean al siguiente de la lista para no llenar results/ de variantes
+    SEG_PREVIEW_SIZES = sorted(int(s) for s in os.getenv('SEG_PREVIEW_SIZES', '256,512,1024,2048').split(',') if s.strip())
+
+    # Geometría de las máscaras en /segment: 'polygon' (simplificado), 'rle' (COCO) o 'none'
+    SEG_MASK_ENCODING = os.getenv('SEG_MASK_ENCODING', 'polygon')
+    # Tolerancia (px) de la simplificación de polígonos
+    SEG_POLYGON_TOLERANCE = float(os.getenv('SEG_POLYGON_TOLERANCE', 1.5))
+
+    # Segmentación por mosaicos para imágenes grandes (tiled=true|auto en /segment)
+    SEG_TILED_DEFAULT = os.getenv('SEG_TILED_DEFAULT', 'false')
+    SEG_TILE_SIZE = int(os.getenv('SEG_TILE_SIZE', 640))
+    SEG_TILE_OVERLAP = float(os.getenv('SEG_TILE_OVERLAP', 0.2))
+    SEG_TILE_MAX_BATCH = int(os.getenv('SEG_TILE_MAX_BATCH', 8))
+    # Lado máximo al que se decodifica la imagen (acota la memoria)
+    SEG_TILE_MAX_SIDE = int(os.getenv('SEG_TILE_MAX_SIDE', 4096))
+    # En modo auto se usa mosaico cuando el lado mayor supera este valor
+    SEG_TILE_AUTO_MIN_SIDE = int(os.getenv('SEG_TILE_AUTO_MIN_SIDE', 1920))
+    SEG_TILE_NMS_IOU = float(os.getenv('SEG_TILE_NMS_IOU', 0.5))
+    SEG_TILE_NMS_IOS = float(os.getenv('SEG_TILE_NMS_IOS', 0.8))
+
+    # /pipeline: margen alrededor de cada caja al recortar (fracción del tamaño)
+    PIPELINE_CROP_PADDING = float(os.getenv('PIPELINE_CROP_PADDING', 0.05))
+
+    # Endpoint /classify/batch
+    MAX_BATCH_FILES = int(os.getenv('MAX_BATCH_FILES', 200))
@@ -0,0 +1,28 @@
+"""
+Configuración de gunicorn.
+
+La app (y los modelos de PRELOAD_MODELS) se carga dentro de cada worker.
+No hay preload_app ni carga de modelos antes del fork: TensorFlow no es
+fork-safe (sus pools de hilos no sobreviven al fork y el primer forward pass
+del worker se cuelga), y compartir solo los backends ONNX/TFLite no se ha
+medido. Antes de reintroducirlo hay que aportar el RSS/PSS por worker con y
+sin pre-fork, medido con scripts/measure_worker_rss.py.
+
+Uso:
+    PRELOAD_MODELS=mobilenetv2,resnet50,yolo WEB_CONCURRENCY=2 \\
+        gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Memoria por worker: python scripts/measure_worker_rss.py <pid_master>
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '80')}")
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 2))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 600))
+
+
+def worker_exit(server, worker):
+    # Vaciar la cola write-behind de predicciones antes de que el worker muera
+    from services.db_service import db_service
+    db_service.shutdown()
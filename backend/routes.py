@@ -1,22 +1,92 @@
-from flask import Blueprint, request, jsonify, send_file
-from services.model_service import model_manager
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
+from services.model_service import model_manager, decode_image, SchedulerClosed
 from services.db_service import db_service
-from utils.file_helpers import save_uploaded_file
-from config import UPLOAD_FOLDER, RESULTS_FOLDER
+from services.cache_service import prediction_cache, near_duplicate_index, dhash
+from services.event_service import prediction_broker, format_sse, to_event
+from services.segmentation_service import (
+    extract_instances, encode_detections, save_segmentation, get_rendered_image, encode_jpeg,
+    segmentation_available, crop_instances, tiled_segment
+)
+from utils.file_helpers import allowed_file, read_uploaded_file, persist_upload, hash_bytes, open_image, uploaded_file_size
+from config import UPLOAD_FOLDER, RESULTS_FOLDER, Config
+import hashlib
+import json
+import queue
 import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 
 api = Blueprint('api', __name__)
 
+# Pool compartido para ejecutar los modelos de /compare en paralelo
+compare_executor = ThreadPoolExecutor(
+    max_workers=max(1, Config.COMPARE_MAX_WORKERS),
+    thread_name_prefix='compare'
+)
+
+def make_etag(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def with_etag(response, etag):
+    # no-cache: el navegador revalida siempre con If-None-Match
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def segmentation_record(response):
+    """
+    Resultado de /segment para la BD: cajas y áreas, sin polígonos ni RLE
+    (la geometría va en la respuesta y en el sidecar JSON del render).
+    """
+    detections = [{k: v for k, v in d.items() if k not in ('polygon', 'rle')}
+                  for d in response['detections']]
+    return {**response, 'detections': detections}
+
+@api.before_request
+def limit_request_size():
+    """Tope por ruta del cuerpo de la petición (Flask solo aplica el global)"""
+    limit_mb = Config.BATCH_REQUEST_MAX_MB if request.endpoint == 'api.classify_batch' else Config.REQUEST_MAX_MB
+    if request.content_length is not None and request.content_length > limit_mb * 1024 * 1024:
+        return jsonify({'error': f'La petición supera el máximo de {limit_mb:g} MB'}), 413
+
+def parse_top_k(default=3):
+    """top_k del formulario, o None si no es un entero >= 1"""
+    try:
+        top_k = int(request.form.get('top_k', default))
+    except (TypeError, ValueError):
+        return None
+    return top_k if top_k >= 1 else None
+
+def not_modified(etag):
+    return with_etag(Response(status=304), etag)
+
 @api.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
         'db_status': db_service.is_connected(),
+        'db_writer': db_service.writer_metrics(),
+        'db_spool': db_service.spool_metrics(),
         # Muestra solo los modelos que ya se han cargado en RAM
-        'models_loaded': list(model_manager.classification_models.keys())
+        'models_loaded': list(model_manager.classification_models.keys()),
+        'batching': model_manager.batching_stats(),
+        'model_memory': model_manager.memory_stats(),
+        'result_cache': prediction_cache.stats(),
+        'near_duplicate_index': near_duplicate_index.stats(),
+        'prediction_stream': prediction_broker.stats()
     })
 
+@api.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 solo cuando terminó la precarga y el warm-up"""
+    status = model_manager.readiness()
+    return jsonify(status), (200 if status['ready'] else 503)
+
 @api.route('/models', methods=['GET'])
 def get_models():
     # Lista estática para que el frontend sepa qué opciones mostrar
@@ -26,6 +96,9 @@ def get_models():
         {'name': 'mobilenetv2', 'type': 'classification', 'num_classes': 10},
         {'name': 'efficientnetb2', 'type': 'classification', 'num_classes': 10}
     ]
+    # Variantes cuantizadas generadas con scripts/quantize_models.py
+    for variant in model_manager.available_variants():
+        models_list.append({'name': variant, 'type': 'classification', 'num_classes': 10})
     return jsonify({'classification_models': models_list})
 
 @api.route('/classify', methods=['POST'])
@@ -35,38 +108,103 @@ def classify_image():
     
     file = request.files['file']
     model_name = request.form.get('model', 'resnet50')
+    top_k = parse_top_k(default=3)
+    if top_k is None:
+        return jsonify({'error': 'top_k debe ser un entero mayor o igual a 1'}), 400
     
-    # 1. Guardar archivo primero (¡Esto faltaba!)
-    filepath = save_uploaded_file(file)
+    # 1. Leer el archivo a memoria; el original se guarda en segundo plano
+    filepath, data = read_uploaded_file(file)
     if not filepath:
         return jsonify({'error': 'Invalid file type'}), 400
-    
-    # 2. Obtener modelo usando Lazy Loading
-    # (Si no está en RAM, lo carga ahora)
-    model = model_manager.get_classification_model(model_name)
-    
-    if not model:
-        return jsonify({'error': f'Model {model_name} not available'}), 503
+    stored_path = persist_upload(filepath, data)
+    content_hash = hash_bytes(data)
+
+    # 2. ¿Ya clasificamos estos mismos bytes con este modelo?
+    start = time.time()
+    version = model_manager.model_version(model_name)
+    cache_key = prediction_cache.make_key(content_hash, model_name, version, {'top_k': top_k})
+    result = prediction_cache.get(cache_key) if version else None
+    cache_hit = result is not None
+    near_duplicate = None
+
+    # 2b. Casi-duplicado: la misma foto recomprimida o recortada levemente
+    # (solo si la caché exacta falló: dhash decodifica la imagen)
+    use_near_dup = (not cache_hit and Config.NEAR_DUP_ENABLED and version and
+                    request.form.get('bypass_near_duplicate', 'false').lower() != 'true')
+    if use_near_dup:
+        try:
+            perceptual_hash = dhash(data)
+        except Exception as e:
+            print(f"⚠️ No se pudo calcular el hash perceptual: {e}")
+            use_near_dup = False
+    near_dup_scope = (model_name, version, top_k)
+    if use_near_dup:
+        found = near_duplicate_index.find(perceptual_hash, near_dup_scope, Config.NEAR_DUP_MAX_DISTANCE)
+        if found is not None:
+            result, distance = found
+            cache_hit = True
+            near_duplicate = {'distance': distance}
+
+    if not cache_hit:
+        # 3. Obtener modelo usando Lazy Loading
+        # (Si no está en RAM, lo carga ahora)
+        model = model_manager.get_classification_model(model_name)
+        
+        if not model:
+            return jsonify({
+                'error': f'Model {model_name} not available',
+                'detail': model_manager.load_error(model_name)
+            }), 503
     
     try:
-        start = time.time()
-        
-        # 3. Predecir
-        result = model.predict(filepath)
+        if not cache_hit:
+            # 4. Predecir (vía micro-batching si está activo)
+            if Config.BATCHING_ENABLED:
+                img_array = model.load_image(data)
+                # Si el modelo se expulsa entre la consulta y el encolado,
+                # se pide un scheduler nuevo (recarga) y se reintenta una vez
+                for attempt in range(2):
+                    scheduler = model_manager.get_batch_scheduler(model_name)
+                    if scheduler is None:
+                        # Expulsado o fallo al recargar entre las dos consultas
+                        return jsonify({
+                            'error': f'Model {model_name} not available',
+                            'detail': model_manager.load_error(model_name)
+                        }), 503
+                    try:
+                        result = scheduler.submit(img_array, top_k=top_k,
+                                                  timeout=Config.BATCH_SUBMIT_TIMEOUT_S)
+                        break
+                    except SchedulerClosed:
+                        if attempt:
+                            return jsonify({'error': 'Modelo recargándose, intenta de nuevo'}), 503
+                    except queue.Full:
+                        return jsonify({'error': 'Servidor saturado, intenta de nuevo'}), 503
+                    except FutureTimeoutError:
+                        return jsonify({'error': 'La inferencia tardó demasiado, intenta de nuevo'}), 504
+            else:
+                result = model.predict(data, top_k=top_k)
+            if version:
+                prediction_cache.set(cache_key, result)
+            if use_near_dup:
+                near_duplicate_index.add(perceptual_hash, near_dup_scope, result)
         elapsed = time.time() - start
         
         response = {
             'model': model_name,
             **result,
+            'cache_hit': cache_hit,
             'processing_time': f"{elapsed:.2f}s"
         }
+        if near_duplicate:
+            response['near_duplicate'] = near_duplicate
         
-        # 4. Guardar en Base de Datos
+        # 5. Guardar en Base de Datos
         db_service.save_prediction({
             'type': 'classification',
             'model': model_name,
             'result': response,
-            'image_path': str(filepath)
+            'image_path': stored_path
         })
         
         return jsonify(response)
@@ -75,8 +213,117 @@ def classify_image():
         print(f"Error en clasificación: {e}")
         return jsonify({'error': str(e)}), 500
 
+@api.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    """Clasifica N imágenes en una sola petición (lotes apilados + un insert_many)"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    if len(files) > Config.MAX_BATCH_FILES:
+        return jsonify({'error': f'Máximo {Config.MAX_BATCH_FILES} imágenes por petición'}), 400
+
+    model_name = request.form.get('model', 'resnet50')
+    top_k = parse_top_k(default=3)
+    if top_k is None:
+        return jsonify({'error': 'top_k debe ser un entero mayor o igual a 1'}), 400
+
+    model = model_manager.get_classification_model(model_name)
+    if not model:
+        return jsonify({
+            'error': f'Model {model_name} not available',
+            'detail': model_manager.load_error(model_name)
+        }), 503
+
+    try:
+        start = time.time()
+        results = [None] * len(files)
+        decode_times = [0.0] * len(files)
+        max_file_bytes = Config.MAX_FILE_MB * 1024 * 1024
+        chunk = max(1, Config.BATCH_MAX_SIZE)
+        records = []
+
+        # Por tandas de BATCH_MAX_SIZE: solo una tanda de bytes y tensores en memoria
+        # (werkzeug deja los archivos grandes en disco hasta que se leen)
+        for offset in range(0, len(files), chunk):
+            # 1. Leer y decodificar las imágenes de la tanda
+            group = []  # (índice original, ruta guardada, array)
+            for i in range(offset, min(offset + chunk, len(files))):
+                file = files[i]
+                t0 = time.time()
+                if uploaded_file_size(file) > max_file_bytes:
+                    results[i] = {'filename': file.filename, 'error': f'Supera el máximo de {Config.MAX_FILE_MB:g} MB'}
+                    continue
+                filepath, data = read_uploaded_file(file)
+                if not filepath:
+                    results[i] = {'filename': file.filename, 'error': 'Invalid file type'}
+                    continue
+                try:
+                    group.append((i, persist_upload(filepath, data), model.load_image(data)))
+                except Exception as e:
+                    results[i] = {'filename': file.filename, 'error': f'No se pudo leer la imagen: {e}'}
+                decode_times[i] = time.time() - t0
+            if not group:
+                continue
+
+            # 2. Inferencia de la tanda en un lote apilado
+            t0 = time.time()
+            predictions = model.predict_arrays([arr for _, _, arr in group])
+            per_image = (time.time() - t0) / len(group)
+
+            for (i, stored_path, _), probs in zip(group, predictions):
+                result = {
+                    'filename': files[i].filename,
+                    'model': model_name,
+                    **model.format_predictions(probs, top_k=top_k),
+                    'processing_time': f"{decode_times[i] + per_image:.3f}s"
+                }
+                results[i] = result
+                records.append({
+                    'type': 'classification',
+                    'model': model_name,
+                    'result': dict(result),
+                    'image_path': stored_path
+                })
+
+        # 3. Guardar todo en BD con una sola escritura
+        db_service.save_predictions(records)
+
+        elapsed = time.time() - start
+        return jsonify({
+            'model': model_name,
+            'results': results,
+            'count': len(results),
+            'processed': len(records),
+            'processing_time': f"{elapsed:.2f}s"
+        })
+
+    except Exception as e:
+        print(f"Error en clasificación por lote: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @api.route('/image/<filename>')
 def get_image(filename):
+    # Solo imágenes: en results/ también están los sidecars JSON y los originales sin extensión
+    if not allowed_file(filename):
+        return jsonify({'error': 'Imagen no encontrada'}), 404
+
+    # Segmentaciones: se renderizan la primera vez que se piden (?size= para una vista previa)
+    if filename.startswith('seg_'):
+        size = request.args.get('size', type=int)
+        if size is not None:
+            if size < 1:
+                return jsonify({'error': 'size debe ser un entero positivo'}), 400
+            # Redondeo al siguiente tamaño fijo (o al mayor)
+            size = next((s for s in Config.SEG_PREVIEW_SIZES if s >= size), Config.SEG_PREVIEW_SIZES[-1])
+        try:
+            path = get_rendered_image(filename, size=size)
+        except Exception as e:
+            print(f"Error renderizando {filename}: {e}")
+            return jsonify({'error': str(e)}), 500
+        if path is not None:
+            # El tipo sale de la extensión: hay overlays antiguos en PNG en results/
+            return send_file(str(path))
+
     # Buscar primero en uploads, luego en results
     if (UPLOAD_FOLDER / filename).exists():
         return send_file(str(UPLOAD_FOLDER / filename))
@@ -91,34 +338,90 @@ def compare_models():
         return jsonify({'error': 'No file provided'}), 400
     
     file = request.files['file']
-    filepath = save_uploaded_file(file)
+    filepath, data = read_uploaded_file(file)
     if not filepath:
         return jsonify({'error': 'Invalid file type'}), 400
+    stored_path = persist_upload(filepath, data)
+    content_hash = hash_bytes(data)
     
-    top_k = int(request.form.get('top_k', 3))
+    top_k = parse_top_k(default=3)
+    if top_k is None:
+        return jsonify({'error': 'top_k debe ser un entero mayor o igual a 1'}), 400
     
     try:
         start = time.time()
         comparisons = {}
+        cache_hits = {}
+        cache_keys = {}
+        timings = {'inference': {}}
         
         # Iterar sobre la lista de modelos conocidos
         model_names = ['resnet50', 'mobilenetv2', 'efficientnetb2']
+
+        # Resultados ya calculados para estos mismos bytes (se comparten con /classify)
+        for name in model_names:
+            version = model_manager.model_version(name)
+            if not version:
+                continue
+            cache_keys[name] = prediction_cache.make_key(content_hash, name, version, {'top_k': top_k})
+            cached = prediction_cache.get(cache_keys[name])
+            cache_hits[name] = cached is not None
+            if cached is not None:
+                comparisons[name] = cached
         
+        # Cargar bajo demanda solo los modelos que faltan
+        t0 = time.time()
+        models = {}
         for name in model_names:
-            # Cargar modelo bajo demanda
+            if name in comparisons:
+                continue
             model = model_manager.get_classification_model(name)
             if model:
-                # Si carga con éxito, predecir
-                result = model.predict(filepath, top_k=top_k)
-                comparisons[name] = result
+                models[name] = model
+        timings['load_models'] = f"{time.time() - t0:.3f}s"
+
+        # 1. Decodificar la imagen una sola vez
+        t0 = time.time()
+        img = decode_image(data) if models else None
+        timings['decode'] = f"{time.time() - t0:.3f}s"
+
+        # 2. Redimensionar una vez por cada img_size distinto
+        t0 = time.time()
+        resized = {}
+        for model in models.values():
+            if model.img_size not in resized:
+                resized[model.img_size] = model.resize_image(img)
+        timings['resize'] = f"{time.time() - t0:.3f}s"
+
+        # 3. Cada modelo aplica su preprocess_fn sobre una copia del buffer compartido.
+        # Los modelos corren en paralelo: la latencia total ≈ la del más lento.
+        def run_model(model):
+            t0 = time.time()
+            predictions = model.predict_arrays([resized[model.img_size]])[0]
+            return model.format_predictions(predictions, top_k=top_k), time.time() - t0
+
+        t0 = time.time()
+        futures = {name: compare_executor.submit(run_model, model) for name, model in models.items()}
+        for name, future in futures.items():
+            result, model_elapsed = future.result()
+            comparisons[name] = result
+            timings['inference'][name] = f"{model_elapsed:.3f}s"
+            if name in cache_keys:
+                prediction_cache.set(cache_keys[name], result)
+        timings['inference_wall'] = f"{time.time() - t0:.3f}s"
             
         elapsed = time.time() - start
         
+        # Mantener el orden de model_names en la respuesta
+        comparisons = {name: comparisons[name] for name in model_names if name in comparisons}
         response = {
             'comparisons': comparisons,
             'timestamp': datetime.utcnow().isoformat(),
             'processing_time': f"{elapsed:.2f}s",
-            'models_compared': len(comparisons)
+            'timings': timings,
+            'models_compared': len(comparisons),
+            'cache_hit': bool(comparisons) and all(cache_hits.get(name) for name in comparisons),
+            'cache_hits': cache_hits
         }
         
         # Guardar en BD
@@ -126,7 +429,7 @@ def compare_models():
             'type': 'comparison',
             'models': list(comparisons.keys()),
             'result': response,
-            'image_path': str(filepath)
+            'image_path': stored_path
         })
         
         return jsonify(response)
@@ -139,55 +442,108 @@ def compare_models():
 @api.route('/segment', methods=['POST'])
 def segment_image():
     """Ruta para segmentación con YOLO"""
-    
-    # Cargar YOLO bajo demanda
-    yolo = model_manager.get_segmentation_model()
-    
-    if not yolo:
-        return jsonify({'error': 'Modelo de segmentación no disponible'}), 503
-
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
     file = request.files['file']
-    filepath = save_uploaded_file(file)
+    filepath, data = read_uploaded_file(file)
     if not filepath:
         return jsonify({'error': 'Invalid file type'}), 400
+    stored_path = persist_upload(filepath, data)
+    content_hash = hash_bytes(data)
 
     conf = float(request.form.get('conf', 0.25))
+    mask_encoding = request.form.get('mask_encoding', Config.SEG_MASK_ENCODING)
+    if mask_encoding not in ('polygon', 'rle', 'none'):
+        return jsonify({'error': "mask_encoding debe ser 'polygon', 'rle' o 'none'"}), 400
+    tolerance = float(request.form.get('tolerance', Config.SEG_POLYGON_TOLERANCE))
+
+    # Mosaicos: 'true', 'false' o 'auto' (según el tamaño, leído de la cabecera sin decodificar)
+    tiled = request.form.get('tiled', Config.SEG_TILED_DEFAULT).lower()
+    if tiled not in ('true', 'false', 'auto'):
+        return jsonify({'error': "tiled debe ser 'true', 'false' o 'auto'"}), 400
+    if tiled == 'auto':
+        try:
+            tiled = 'true' if max(open_image(data).size) > Config.SEG_TILE_AUTO_MIN_SIDE else 'false'
+        except Exception:
+            return jsonify({'error': 'No se pudo leer la imagen'}), 400
+    tiled = tiled == 'true'
+
+    # ¿Misma imagen y mismos parámetros ya segmentados? (la imagen debe seguir disponible)
+    start = time.time()
+    version = model_manager.model_version(model_manager.SEGMENTATION_KEY)
+    cache_params = {'conf': conf, 'mask_encoding': mask_encoding, 'tolerance': tolerance, 'tiled': tiled}
+    cache_key = prediction_cache.make_key(content_hash, model_manager.SEGMENTATION_KEY, version, cache_params)
+    cached = prediction_cache.get(cache_key) if version else None
+    if cached is not None and segmentation_available(cached['result_image']):
+        response = {
+            **cached,
+            'cache_hit': True,
+            'processing_time': f"{time.time() - start:.2f}s"
+        }
+        db_service.save_prediction({
+            'type': 'segmentation',
+            'model': 'yolo',
+            'result': segmentation_record(response),
+            'image_path': stored_path
+        })
+        return jsonify(response)
+
+    # Cargar YOLO bajo demanda
+    yolo = model_manager.get_segmentation_model()
+    
+    if not yolo:
+        return jsonify({
+            'error': 'Modelo de segmentación no disponible',
+            'detail': model_manager.load_error(model_manager.SEGMENTATION_KEY)
+        }), 503
 
     try:
-        start = time.time()
-        
-        # Ruta de salida para la imagen segmentada
-        filename = f"seg_{filepath.name}"
+        timings = {}
+
+        # Ruta de salida para la imagen segmentada (siempre JPEG, se codifica una vez)
+        filename = f"seg_{filepath.stem}.jpg"
         result_path = RESULTS_FOLDER / filename
         
-        # Predicción usando YOLO
-        results = yolo.predict(
-            source=str(filepath),
-            conf=conf,
-            save=True,
-            project=str(RESULTS_FOLDER.parent), 
-            name='results', 
-            exist_ok=True,
-            verbose=False
-        )
-        
+        if tiled:
+            return segment_tiled(yolo, data, filename, stored_path, conf, tolerance,
+                                 start, version, cache_key)
+
+        # Predicción usando YOLO directamente sobre el ndarray (YOLO espera BGR)
+        t0 = time.time()
+        img_bgr = np.ascontiguousarray(np.asarray(decode_image(data))[:, :, ::-1])
+        timings['decode'] = f"{time.time() - t0:.3f}s"
+
+        # Sin save=True: Ultralytics no renderiza ni escribe su propia copia
+        t0 = time.time()
+        results = yolo.predict(source=img_bgr, conf=conf, save=False, verbose=False)
         result = results[0]
-        img_with_masks = result.plot()
-        import cv2
-        cv2.imwrite(str(result_path), img_with_masks)
+        timings['inference'] = f"{time.time() - t0:.3f}s"
+
+        if Config.SEG_LAZY_RENDER:
+            # Solo guardamos cajas y contornos; la imagen se renderiza al pedirla
+            t0 = time.time()
+            save_segmentation(filename, stored_path, data, img_bgr.shape, extract_instances(result))
+            timings['store'] = f"{time.time() - t0:.3f}s"
+        else:
+            # Render de la superposición una sola vez
+            t0 = time.time()
+            img_with_masks = result.plot()
+            timings['render'] = f"{time.time() - t0:.3f}s"
+
+            # Codificación en un solo paso y escritura de los bytes ya codificados
+            t0 = time.time()
+            encoded = encode_jpeg(img_with_masks)
+            timings['encode'] = f"{time.time() - t0:.3f}s"
+
+            t0 = time.time()
+            result_path.write_bytes(encoded)
+            timings['write'] = f"{time.time() - t0:.3f}s"
         
-        # Extraer datos de detección
-        detections = []
-        if result.boxes:
-            for box in result.boxes:
-                detections.append({
-                    'class_id': int(box.cls),
-                    'class_name': result.names[int(box.cls)],
-                    'confidence': float(box.conf)
-                })
+        # Extraer datos de detección (con cajas, áreas y máscaras compactas)
+        t0 = time.time()
+        detections = encode_detections(result, encoding=mask_encoding, tolerance=tolerance)
+        timings['masks'] = f"{time.time() - t0:.3f}s"
 
         elapsed = time.time() - start
 
@@ -195,15 +551,23 @@ def segment_image():
             'num_detections': len(detections),
             'detections': detections,
             'result_image': filename,
-            'processing_time': f"{elapsed:.2f}s"
+            'cache_hit': False,
+            'processing_time': f"{elapsed:.2f}s",
+            'timings': timings
         }
+        if version:
+            prediction_cache.set(cache_key, {
+                'num_detections': len(detections),
+                'detections': detections,
+                'result_image': filename
+            })
 
         # Guardar en BD
         db_service.save_prediction({
             'type': 'segmentation',
             'model': 'yolo',
-            'result': response,
-            'image_path': str(filepath)
+            'result': segmentation_record(response),
+            'image_path': stored_path
         })
 
         return jsonify(response)
@@ -212,6 +576,149 @@ def segment_image():
         print(f"Error en segmentación: {e}")
         return jsonify({'error': str(e)}), 500
 
+def segment_tiled(yolo, data, filename, stored_path, conf, tolerance, start, version, cache_key):
+    """/segment en modo mosaico: las máscaras se devuelven siempre como polígonos"""
+    timings = {}
+
+    t0 = time.time()
+    detections, orig_shape, tile_stats = tiled_segment(yolo, data, conf, tolerance=tolerance)
+    timings['tiled_inference'] = f"{time.time() - t0:.3f}s"
+
+    # Los polígonos ya están en coordenadas originales: sirven para el render diferido
+    t0 = time.time()
+    instances = [{**d, 'polygon': np.round(d['polygon']).astype(int).tolist() if d['polygon'] else []}
+                 for d in detections]
+    save_segmentation(filename, stored_path, data, orig_shape, instances)
+    if not Config.SEG_LAZY_RENDER:
+        get_rendered_image(filename)
+    timings['store'] = f"{time.time() - t0:.3f}s"
+
+    response = {
+        'num_detections': len(detections),
+        'detections': detections,
+        'result_image': filename,
+        'mask_encoding': 'polygon',
+        'tiling': tile_stats,
+        'cache_hit': False,
+        'processing_time': f"{time.time() - start:.2f}s",
+        'timings': timings
+    }
+    if version:
+        prediction_cache.set(cache_key, {
+            'num_detections': len(detections),
+            'detections': detections,
+            'result_image': filename,
+            'mask_encoding': 'polygon',
+            'tiling': tile_stats
+        })
+
+    db_service.save_prediction({
+        'type': 'segmentation',
+        'model': 'yolo',
+        'result': segmentation_record(response),
+        'image_path': stored_path
+    })
+    return jsonify(response)
+
+@api.route('/pipeline', methods=['POST'])
+def detect_and_classify():
+    """Segmenta con YOLO y clasifica la madurez de cada tomate detectado en un solo lote"""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    file = request.files['file']
+    filepath, data = read_uploaded_file(file)
+    if not filepath:
+        return jsonify({'error': 'Invalid file type'}), 400
+    stored_path = persist_upload(filepath, data)
+
+    model_name = request.form.get('model', 'resnet50')
+    conf = float(request.form.get('conf', 0.25))
+    top_k = parse_top_k(default=1)
+    if top_k is None:
+        return jsonify({'error': 'top_k debe ser un entero mayor o igual a 1'}), 400
+    masked = request.form.get('masked', 'false').lower() == 'true'
+
+    yolo = model_manager.get_segmentation_model()
+    if not yolo:
+        return jsonify({
+            'error': 'Modelo de segmentación no disponible',
+            'detail': model_manager.load_error(model_manager.SEGMENTATION_KEY)
+        }), 503
+    model = model_manager.get_classification_model(model_name)
+    if not model:
+        return jsonify({
+            'error': f'Model {model_name} not available',
+            'detail': model_manager.load_error(model_name)
+        }), 503
+
+    try:
+        start = time.time()
+        timings = {}
+
+        # 1. Decodificar una vez: RGB para los recortes, vista BGR para YOLO
+        t0 = time.time()
+        img_rgb = np.asarray(decode_image(data))
+        img_bgr = np.ascontiguousarray(img_rgb[:, :, ::-1])
+        timings['decode'] = f"{time.time() - t0:.3f}s"
+
+        # 2. Detección
+        t0 = time.time()
+        result = yolo.predict(source=img_bgr, conf=conf, save=False, verbose=False)[0]
+        timings['detection'] = f"{time.time() - t0:.3f}s"
+
+        # 3. Recortes en memoria (vistas) redimensionados al tamaño del clasificador
+        t0 = time.time()
+        crops = crop_instances(img_rgb, result, masked=masked, padding=Config.PIPELINE_CROP_PADDING)
+        arrays = [model.resize_array(crop) for _, crop in crops]
+        timings['crop'] = f"{time.time() - t0:.3f}s"
+
+        # 4. Clasificación de todos los recortes en lotes apilados
+        t0 = time.time()
+        probabilities = []
+        chunk = max(1, Config.BATCH_MAX_SIZE)
+        for offset in range(0, len(arrays), chunk):
+            probabilities.extend(model.predict_arrays(arrays[offset:offset + chunk]))
+        timings['classification'] = f"{time.time() - t0:.3f}s"
+
+        boxes = result.boxes.xyxy.cpu().numpy() if result.boxes else []
+        det_conf = result.boxes.conf.cpu().numpy() if result.boxes else []
+        tomatoes = []
+        counts = {name: 0 for name in model.classes}
+        for (det_index, _), probs in zip(crops, probabilities):
+            ripeness = model.format_predictions(probs, top_k=top_k)
+            counts[ripeness['top_class']] = counts.get(ripeness['top_class'], 0) + 1
+            tomatoes.append({
+                'id': det_index,
+                'box': [round(float(v), 1) for v in boxes[det_index]],
+                'detection_confidence': float(det_conf[det_index]),
+                **ripeness
+            })
+
+        elapsed = time.time() - start
+        response = {
+            'model': model_name,
+            'num_tomatoes': len(tomatoes),
+            'tomatoes': tomatoes,
+            'counts': counts,
+            'masked_crops': masked,
+            'timings': timings,
+            'processing_time': f"{elapsed:.2f}s"
+        }
+
+        db_service.save_prediction({
+            'type': 'pipeline',
+            'model': model_name,
+            'result': response,
+            'image_path': stored_path
+        })
+
+        return jsonify(response)
+
+    except Exception as e:
+        print(f"Error en pipeline: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @api.route('/predictions', methods=['GET'])
 def get_predictions():
     """Obtiene el historial de predicciones"""
@@ -220,25 +727,122 @@ def get_predictions():
     
     try:
         limit = int(request.args.get('limit', 50))
+        limit = max(1, min(limit, Config.PREDICTIONS_MAX_PAGE_SIZE))
         pred_type = request.args.get('type')
         model = request.args.get('model')
+        cursor = request.args.get('cursor')
+        # p.ej. ?fields=type,model,top_class,confidence,thumbnail
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+        # Delta-sync: solo lo escrito después del último _id que vio el cliente
+        since_id = request.args.get('since')
+
+        # ETag: si la colección no cambió desde la última consulta, 304 sin re-consultar
+        etag = make_etag(request.query_string, db_service.collection_version())
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
         
         filters = {}
         if pred_type:
             filters['type'] = pred_type
         if model:
             filters['model'] = model
+
+        since = db_service.resolve_since(since_id) if since_id else None
             
-        predictions = db_service.get_all_predictions(limit=limit, filters=filters)
+        try:
+            predictions, next_cursor = db_service.get_predictions_page(
+                limit=limit, filters=filters, cursor=cursor, fields=fields, since=since
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        return jsonify({
+        response = jsonify({
             'predictions': predictions,
-            'count': len(predictions)
+            'count': len(predictions),
+            'next_cursor': next_cursor,
+            # since desconocido (p.ej. registro borrado): el cliente debe reemplazar su lista
+            'full_refresh': bool(since_id) and since is None
         })
+        return with_etag(response, etag)
     except Exception as e:
         print(f"Error obteniendo historial: {e}")
         return jsonify({'error': str(e)}), 500
 
+@api.route('/predictions/stream', methods=['GET'])
+def stream_predictions():
+    """Server-Sent Events con las predicciones nuevas (filtros opcionales ?type= y ?model=)"""
+    pred_type = request.args.get('type')
+    model = request.args.get('model')
+    subscriber = prediction_broker.subscribe(pred_type=pred_type, model=model)
+    if subscriber is None:
+        return jsonify({'error': 'Demasiadas conexiones de streaming'}), 503
+
+    # Reconexión: el navegador manda Last-Event-ID y recuperamos lo que se perdió.
+    # Ya estamos suscritos, así que nada se pierde entre la consulta y el stream
+    # (lo que llegue por ambos lados se envía una sola vez).
+    last_event_id = request.headers.get('Last-Event-ID')
+    missed = []
+    reset = False
+    if last_event_id:
+        try:
+            since = db_service.resolve_since(last_event_id) if db_service.is_connected() else None
+            if since is None:
+                # Id desconocido o sin BD: el cliente debe recargar el historial
+                reset = True
+            else:
+                filters = {k: v for k, v in (('type', pred_type), ('model', model)) if v}
+                cursor = None
+                while True:
+                    page, cursor = db_service.get_predictions_page(
+                        limit=Config.PREDICTIONS_MAX_PAGE_SIZE, filters=filters, cursor=cursor, since=since
+                    )
+                    missed.extend(page)
+                    if cursor is None:
+                        break
+                    if len(missed) >= Config.SSE_REPLAY_MAX:
+                        # Hueco demasiado grande para reenviarlo entero
+                        reset = True
+                        missed = []
+                        break
+        except Exception as e:
+            # Mongo falló a mitad del replay: no se pierde el suscriptor, el cliente recarga
+            print(f"⚠️ No se pudo recuperar el historial para SSE: {e}")
+            reset = True
+            missed = []
+    replayed = {record['_id'] for record in missed}
+
+    def generate():
+        try:
+            if reset:
+                yield format_sse({'reason': 'history gap'}, event_name='reset')
+            for record in reversed(missed):
+                yield format_sse(to_event(record), event_id=record['_id'])
+            while True:
+                try:
+                    event = subscriber.queue.get(timeout=Config.SSE_HEARTBEAT_S)
+                except queue.Empty:
+                    # Heartbeat: mantiene viva la conexión y detecta clientes caídos
+                    yield ': ping\n\n'
+                    continue
+                if event is None:
+                    yield format_sse({'reason': 'slow consumer'}, event_name='dropped')
+                    return
+                if event['_id'] in replayed:
+                    replayed.discard(event['_id'])
+                    continue
+                yield format_sse(event, event_id=event['_id'])
+        finally:
+            prediction_broker.unsubscribe(subscriber)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Si el cliente se va antes de que empiece el generador, su finally no corre
+    response.call_on_close(lambda: prediction_broker.unsubscribe(subscriber))
+    return response
+
 @api.route('/stats', methods=['GET'])
 def get_stats():
     """Obtiene estadísticas generales"""
@@ -258,7 +862,11 @@ def get_stats():
             }
         }
         
-        return jsonify(stats)
+        # Las stats salen de memoria: el ETag es la huella del propio contenido
+        etag = make_etag(json.dumps(stats, sort_keys=True))
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+        return with_etag(jsonify(stats), etag)
     except Exception as e:
         print(f"Error obteniendo stats: {e}")
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Benchmark de índices de la colección predictions.
+
+Siembra registros sintéticos (1M por defecto) en un mongod local, mide la
+latencia de las consultas del historial sin índices y después con los
+índices de DBService.INDEXES, y muestra la comparación.
+
+Usa una base de datos aparte para no tocar datos reales.
+
+Uso (desde backend/, con mongod corriendo en localhost):
+    python scripts/benchmark_indexes.py [num_registros]
+    MONGO_BENCH_URI=mongodb://localhost:27017/ python scripts/benchmark_indexes.py 200000
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient, ASCENDING, DESCENDING
+
+MONGO_URI = os.getenv('MONGO_BENCH_URI', 'mongodb://localhost:27017/')
+DB_NAME = 'tomato_benchmark'
+SEED_BATCH = 10000
+REPEATS = 20
+
+TYPES = ['classification'] * 6 + ['segmentation'] * 3 + ['comparison']
+MODELS = ['resnet50', 'mobilenetv2', 'efficientnetb2']
+CLASSES = ['Unripe', 'Old', 'Damaged', 'Ripe']
+
+# Los mismos que DBService.INDEXES (no importamos db_service: conectaría a la BD real)
+INDEXES = {
+    'timestamp_id_desc': [('timestamp', DESCENDING), ('_id', DESCENDING)],
+    'type_timestamp_id': [('type', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+    'model_timestamp_id': [('model', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+    'seq_desc': [('seq', DESCENDING)],
+}
+
+# (descripción, filtro) como las que hace /api/predictions
+QUERIES = [
+    ('últimas 50', {}),
+    ('type=classification', {'type': 'classification'}),
+    ('type=segmentation', {'type': 'segmentation'}),
+    ('model=efficientnetb2', {'model': 'efficientnetb2'}),
+    ('type+model', {'type': 'classification', 'model': 'mobilenetv2'}),
+]
+
+
+def synthetic_record(ts):
+    pred_type = random.choice(TYPES)
+    record = {'type': pred_type, 'timestamp': ts, 'image_path': f"uploads/{ts:%Y%m%d_%H%M%S}_img.jpg"}
+    if pred_type == 'classification':
+        top = random.choice(CLASSES)
+        record['model'] = random.choice(MODELS)
+        record['result'] = {'top_class': top, 'top_confidence': random.random()}
+    elif pred_type == 'segmentation':
+        record['model'] = 'yolo'
+        record['result'] = {'num_detections': random.randint(0, 12)}
+    else:
+        record['models'] = MODELS
+        record['result'] = {'models_compared': 3}
+    return record
+
+
+def seed(collection, count):
+    collection.drop()
+    start_ts = datetime.utcnow() - timedelta(days=365)
+    step = timedelta(days=365) / count
+    t0 = time.perf_counter()
+    for offset in range(0, count, SEED_BATCH):
+        batch = [synthetic_record(start_ts + step * i) for i in range(offset, min(offset + SEED_BATCH, count))]
+        collection.insert_many(batch, ordered=False)
+        print(f"\r🌱 Sembrados {offset + len(batch):,}/{count:,}", end='', flush=True)
+    print(f"  ({time.perf_counter() - t0:.1f}s)")
+
+
+def measure(collection):
+    """Mediana y p95 (ms) de cada consulta con sort por (timestamp, _id) y limit 50"""
+    results = {}
+    for name, query in QUERIES:
+        times = []
+        for _ in range(REPEATS):
+            t0 = time.perf_counter()
+            list(collection.find(query).sort([('timestamp', -1), ('_id', -1)]).limit(50))
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        results[name] = (statistics.median(times), times[int(len(times) * 0.95) - 1])
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    collection = client[DB_NAME]['predictions']
+
+    seed(collection, count)
+
+    collection.drop_indexes()
+    before = measure(collection)
+
+    t0 = time.perf_counter()
+    for index_name, keys in INDEXES.items():
+        collection.create_index(keys, name=index_name)
+    print(f"🗂️ Índices creados en {time.perf_counter() - t0:.1f}s")
+    after = measure(collection)
+
+    print(f"\n{'consulta':<24}{'sin índice p50':>16}{'p95':>10}{'con índice p50':>16}{'p95':>10}{'mejora':>10}")
+    for name, _ in QUERIES:
+        b50, b95 = before[name]
+        a50, a95 = after[name]
+        print(f"{name:<24}{b50:>14.1f}ms{b95:>8.1f}ms{a50:>14.1f}ms{a95:>8.1f}ms{b50 / max(a50, 1e-6):>9.0f}x")
+
+    client.drop_database(DB_NAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Compara el backend ONNX contra Keras sobre las imágenes de backend/uploads.
+
+Para cada modelo convierte (o reutiliza) el .onnx, clasifica todo el corpus
+con ambos backends y reporta acuerdo top-1, diferencia máxima de
+probabilidades y latencia media por imagen.
+
+Uso (desde backend/):
+    python scripts/check_onnx_parity.py [resnet50 mobilenetv2 efficientnetb2]
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import MODELS_DIR, UPLOAD_FOLDER  # noqa: E402
+from services.model_service import ClassificationModel, OnnxClassificationModel  # noqa: E402
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.gif'}
+BATCH_SIZE = 16
+
+
+def find_model_files(name):
+    path = MODELS_DIR / name
+    model_file = next(path.glob("*.h5"), next(path.glob("*.keras"), None))
+    return model_file, path / 'config.json'
+
+
+def run_corpus(model, images):
+    """Devuelve (probabilidades [N, C], segundos por imagen)"""
+    outputs = []
+    start = time.perf_counter()
+    for offset in range(0, len(images), BATCH_SIZE):
+        arrays = [model.load_image(p) for p in images[offset:offset + BATCH_SIZE]]
+        outputs.append(np.asarray(model.predict_arrays(arrays)))
+    elapsed = time.perf_counter() - start
+    return np.concatenate(outputs, axis=0), elapsed / max(1, len(images))
+
+
+def main():
+    names = sys.argv[1:] or ['resnet50', 'mobilenetv2', 'efficientnetb2']
+    images = sorted(p for p in UPLOAD_FOLDER.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    print(f"📂 {len(images)} imágenes en {UPLOAD_FOLDER}")
+
+    failed = False
+    for name in names:
+        model_file, config_file = find_model_files(name)
+        if model_file is None:
+            print(f"❌ {name}: archivos no encontrados")
+            failed = True
+            continue
+
+        keras_probs, keras_time = run_corpus(ClassificationModel(model_file, config_file), images)
+        onnx_probs, onnx_time = run_corpus(OnnxClassificationModel(model_file, config_file), images)
+
+        agreement = float(np.mean(keras_probs.argmax(axis=1) == onnx_probs.argmax(axis=1)))
+        max_diff = float(np.max(np.abs(keras_probs - onnx_probs)))
+        failed |= agreement < 1.0
+
+        print(f"{name:<16} top-1 acuerdo {agreement * 100:6.2f}%  "
+              f"max |Δp| {max_diff:.2e}  "
+              f"keras {keras_time * 1000:7.1f} ms/img  onnx {onnx_time * 1000:7.1f} ms/img")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
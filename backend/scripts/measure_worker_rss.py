@@ -0,0 +1,62 @@
+"""
+Mide la memoria de los workers de gunicorn (RSS, PSS, compartida y privada).
+
+RSS cuenta las páginas compartidas en cada proceso; la memoria real del
+contenedor es el PSS total. Sirve para conocer el coste por worker antes de
+cambiar WEB_CONCURRENCY, y es la medición que debe acompañar cualquier
+propuesta de compartir pesos entre workers (ver gunicorn.conf.py):
+
+    PRELOAD_MODELS=mobilenetv2,resnet50,yolo WEB_CONCURRENCY=1 \\
+        gunicorn -c gunicorn.conf.py "app:create_app()" &
+    curl -s localhost/api/ready   # esperar a ready=true
+    python scripts/measure_worker_rss.py <pid_master>
+
+    # Repetir con WEB_CONCURRENCY=2: la diferencia de PSS total es lo que
+    # cuesta cada worker adicional.
+
+Solo funciona en Linux (/proc).
+"""
+import sys
+from pathlib import Path
+
+FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+
+
+def read_memory(pid):
+    """Lee /proc/<pid>/smaps_rollup y devuelve los campos en MB"""
+    values = {}
+    for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+        parts = line.split()
+        key = parts[0].rstrip(':')
+        if key in FIELDS:
+            values[key] = int(parts[1]) / 1024
+    return values
+
+
+def children(pid):
+    path = Path(f"/proc/{pid}/task/{pid}/children")
+    return [int(p) for p in path.read_text().split()] if path.exists() else []
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Uso: python scripts/measure_worker_rss.py <pid_master_gunicorn>")
+        sys.exit(1)
+
+    master = int(sys.argv[1])
+    pids = [('master', master)] + [('worker', pid) for pid in children(master)]
+
+    print(f"{'proceso':<16}{'RSS':>10}{'PSS':>10}{'Shared':>10}{'Private':>10}  (MB)")
+    total_pss = 0.0
+    for role, pid in pids:
+        mem = read_memory(pid)
+        shared = mem.get('Shared_Clean', 0) + mem.get('Shared_Dirty', 0)
+        private = mem.get('Private_Clean', 0) + mem.get('Private_Dirty', 0)
+        total_pss += mem.get('Pss', 0)
+        print(f"{role + ' ' + str(pid):<16}{mem.get('Rss', 0):>10.1f}{mem.get('Pss', 0):>10.1f}"
+              f"{shared:>10.1f}{private:>10.1f}")
+    print(f"PSS total: {total_pss:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
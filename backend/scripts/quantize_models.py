@@ -0,0 +1,144 @@
+"""
+Cuantización post-entrenamiento de los clasificadores y reporte de
+precisión vs latencia.
+
+Genera, a partir de models/<nombre>/, las variantes:
+    models/<nombre>-int8/model.tflite      (rango dinámico int8)
+    models/<nombre>-float16/model.tflite   (pesos en float16)
+cada una con su config.json ("backend": "tflite"), de modo que ModelManager
+las sirve con nombres como 'mobilenetv2-int8'.
+
+Después clasifica las imágenes de backend/uploads con el modelo fp32 y con
+cada variante y reporta acuerdo top-1, latencia por imagen, tamaño en disco
+y RSS añadido al cargar.
+
+Uso (desde backend/):
+    python scripts/quantize_models.py                 # cuantizar + reporte
+    python scripts/quantize_models.py --report-only   # solo reporte
+    python scripts/quantize_models.py mobilenetv2     # un solo modelo
+"""
+import gc
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import MODELS_DIR, UPLOAD_FOLDER  # noqa: E402
+from services.model_service import ClassificationModel, TFLiteClassificationModel  # noqa: E402
+
+DEFAULT_MODELS = ['resnet50', 'mobilenetv2', 'efficientnetb2']
+VARIANTS = ['int8', 'float16']
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.gif'}
+BATCH_SIZE = 16
+
+
+def find_model_files(name):
+    path = MODELS_DIR / name
+    model_file = next(path.glob("*.h5"), next(path.glob("*.keras"), None))
+    return model_file, path / 'config.json'
+
+
+def rss_mb():
+    """RSS actual del proceso (Linux)"""
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def quantize(name, variant):
+    import tensorflow as tf
+    from tensorflow import keras
+
+    model_file, config_file = find_model_files(name)
+    if model_file is None:
+        raise FileNotFoundError(f"Archivos de {name} no encontrados")
+
+    model = keras.models.load_model(str(model_file), compile=False)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+
+    out_dir = MODELS_DIR / f"{name}-{variant}"
+    out_dir.mkdir(exist_ok=True)
+    (out_dir / 'model.tflite').write_bytes(tflite_model)
+
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    # model_name se mantiene (decide el preprocess); el nombre servido es el del directorio
+    config.update({'backend': 'tflite', 'variant': variant, 'source': model_file.name})
+    with open(out_dir / 'config.json', 'w') as f:
+        json.dump(config, f, indent=2)
+
+    del model
+    gc.collect()
+    print(f"✅ {out_dir.name}: {len(tflite_model) / 1024 / 1024:.1f} MB")
+
+
+def evaluate(model_cls, model_file, config_file, images):
+    """Devuelve (probabilidades, ms por imagen, MB en disco, MB de RSS al cargar)"""
+    gc.collect()
+    rss_before = rss_mb()
+    model = model_cls(model_file, config_file)
+    rss_delta = rss_mb() - rss_before
+
+    outputs = []
+    start = time.perf_counter()
+    for offset in range(0, len(images), BATCH_SIZE):
+        arrays = [model.load_image(p) for p in images[offset:offset + BATCH_SIZE]]
+        outputs.append(np.asarray(model.predict_arrays(arrays)))
+    ms_per_image = (time.perf_counter() - start) * 1000 / max(1, len(images))
+
+    size_mb = Path(model_file).stat().st_size / 1024 / 1024
+    del model
+    gc.collect()
+    return np.concatenate(outputs, axis=0), ms_per_image, size_mb, rss_delta
+
+
+def report(names, images):
+    print(f"\n📂 {len(images)} imágenes en {UPLOAD_FOLDER}\n")
+    print(f"{'modelo':<22}{'top-1 vs fp32':>14}{'ms/img':>10}{'disco MB':>10}{'RSS MB':>10}")
+
+    for name in names:
+        model_file, config_file = find_model_files(name)
+        if model_file is None:
+            print(f"❌ {name}: archivos no encontrados")
+            continue
+
+        base_probs, base_ms, base_size, base_rss = evaluate(ClassificationModel, model_file, config_file, images)
+        base_top1 = base_probs.argmax(axis=1)
+        print(f"{name:<22}{'100.00%':>14}{base_ms:>10.1f}{base_size:>10.1f}{base_rss:>10.1f}")
+
+        for variant in VARIANTS:
+            variant_dir = MODELS_DIR / f"{name}-{variant}"
+            if not (variant_dir / 'model.tflite').exists():
+                print(f"{variant_dir.name:<22}{'(no generado)':>14}")
+                continue
+            probs, ms, size, rss = evaluate(
+                TFLiteClassificationModel, variant_dir / 'model.tflite', variant_dir / 'config.json', images
+            )
+            agreement = float(np.mean(probs.argmax(axis=1) == base_top1)) * 100
+            print(f"{variant_dir.name:<22}{agreement:>13.2f}%{ms:>10.1f}{size:>10.1f}{rss:>10.1f}")
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    names = args or DEFAULT_MODELS
+
+    if '--report-only' not in sys.argv:
+        for name in names:
+            for variant in VARIANTS:
+                quantize(name, variant)
+
+    images = sorted(p for p in UPLOAD_FOLDER.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    report(names, images)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import hashlib
+import itertools
+import json
+import threading
+import numpy as np
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+from PIL import Image
+from config import Config
+from utils.file_helpers import open_image, write_atomic
+
+
+class PredictionCache:
+    """
+    Caché de resultados por contenido: la clave es el SHA-256 de los bytes
+    subidos + modelo + versión del modelo + parámetros (top_k, conf...).
+    Nivel 1 en memoria (LRU) y nivel 2 opcional en disco (un JSON por clave).
+    """
+    def __init__(self, max_entries=1024, disk_dir=None, enabled=True):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits_memory': 0, 'hits_disk': 0, 'misses': 0, 'stores': 0}
+
+    @staticmethod
+    def make_key(content_hash, model_name, model_version, params=None):
+        payload = json.dumps(
+            [content_hash, model_name, model_version, params or {}],
+            sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.counters['hits_memory'] += 1
+                return value
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                value = json.loads(path.read_text())
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.counters['hits_disk'] += 1
+                return value
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self._remember(key, value)
+        with self._lock:
+            self.counters['stores'] += 1
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(exist_ok=True)
+                write_atomic(path, json.dumps(value, default=str).encode('utf-8'))
+            except OSError as e:
+                print(f"⚠️ No se pudo guardar en caché de disco: {e}")
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            self._disk_path(key).unlink(missing_ok=True)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters['hits_memory'] + self.counters['hits_disk']
+            total = hits + self.counters['misses']
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_tier': str(self.disk_dir) if self.disk_dir else None,
+                'hit_rate': round(hits / total, 3) if total else 0.0,
+                **self.counters
+            }
+
+def dhash(source, hash_size=8):
+    """
+    Hash perceptual (dHash) de 64 bits: compara píxeles vecinos de una
+    miniatura en gris, así que sobrevive a recompresión y recortes leves.
+    """
+    img = open_image(source)
+    # En JPEG, draft decodifica directamente a baja resolución (mucho más rápido)
+    img.draft('L', (hash_size * 8, hash_size * 8))
+    img = img.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(img, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class NearDuplicateIndex:
+    """
+    Índice multi-hash (MIH) para buscar hashes de 64 bits a distancia de
+    Hamming <= r. El hash se parte en 4 trozos de 16 bits: si dos hashes
+    están a distancia <= r, al menos un trozo está a distancia <= r // 4
+    (principio del palomar). Así solo se comparan los candidatos de unos
+    pocos buckets, y la búsqueda sigue siendo rápida con cientos de miles
+    de imágenes.
+    """
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    CHUNK_MASK = (1 << 16) - 1
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        # scope -> [por trozo: valor de 16 bits -> lista de ids]. Listas y no sets,
+        # y sin tuplas (scope, trozo) como clave: casi todos los buckets tienen un id
+        self._buckets = defaultdict(lambda: [{} for _ in range(self.CHUNKS)])
+        self._entries = OrderedDict()  # id -> (hash, scope, resultado compacto)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.counters = {'lookups': 0, 'near_hits': 0, 'added': 0}
+
+    def _chunks(self, value):
+        return [(value >> (self.CHUNK_BITS * i)) & self.CHUNK_MASK for i in range(self.CHUNKS)]
+
+    def _neighbors(self, chunk, radius):
+        """Todos los valores de 16 bits a distancia <= radius de chunk"""
+        yield chunk
+        for r in range(1, radius + 1):
+            for bits in itertools.combinations(range(self.CHUNK_BITS), r):
+                flipped = chunk
+                for bit in bits:
+                    flipped ^= 1 << bit
+                yield flipped
+
+    @staticmethod
+    def _compact(result):
+        """Solo (clase, confianza) del top-k; el dict de la API se rearma en find()"""
+        return tuple((p['class'], p['confidence']) for p in result['predictions'])
+
+    @staticmethod
+    def _expand(compact):
+        predictions = [
+            {'class': name, 'confidence': confidence, 'confidence_percent': f"{confidence * 100:.2f}%"}
+            for name, confidence in compact
+        ]
+        return {
+            'predictions': predictions,
+            'top_class': predictions[0]['class'],
+            'top_confidence': predictions[0]['confidence']
+        }
+
+    def add(self, value, scope, result):
+        compact = self._compact(result)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (value, scope, compact)
+            scope_buckets = self._buckets[scope]
+            for i, chunk in enumerate(self._chunks(value)):
+                scope_buckets[i].setdefault(chunk, []).append(entry_id)
+            self.counters['added'] += 1
+
+            # Solo recordamos las imágenes más recientes
+            while len(self._entries) > self.max_entries:
+                old_id, (old_value, old_scope, _) = self._entries.popitem(last=False)
+                scope_buckets = self._buckets[old_scope]
+                for i, chunk in enumerate(self._chunks(old_value)):
+                    bucket = scope_buckets[i].get(chunk)
+                    if bucket is not None:
+                        # El más antiguo va primero en la lista
+                        bucket.remove(old_id)
+                        if not bucket:
+                            del scope_buckets[i][chunk]
+                if not any(scope_buckets):
+                    del self._buckets[old_scope]
+
+    def find(self, value, scope, max_distance):
+        """Devuelve (resultado, distancia) del vecino más cercano, o None"""
+        radius = max_distance // self.CHUNKS
+        with self._lock:
+            self.counters['lookups'] += 1
+            candidates = set()
+            scope_buckets = self._buckets.get(scope)
+            if scope_buckets is None:
+                return None
+            for i, chunk in enumerate(self._chunks(value)):
+                buckets = scope_buckets[i]
+                for neighbor in self._neighbors(chunk, radius):
+                    ids = buckets.get(neighbor)
+                    if ids:
+                        candidates.update(ids)
+
+            best = None
+            for entry_id in candidates:
+                other, _, result = self._entries[entry_id]
+                distance = bin(value ^ other).count('1')
+                # Empate: nos quedamos con el más reciente (id mayor)
+                if distance <= max_distance and (best is None or (distance, -entry_id) < (best[1], -best[2])):
+                    best = (result, distance, entry_id)
+
+            if best is None:
+                return None
+            self.counters['near_hits'] += 1
+        return self._expand(best[0]), best[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                **self.counters
+            }
+
+# Instancias Singleton
+near_duplicate_index = NearDuplicateIndex(max_entries=Config.NEAR_DUP_MAX_ENTRIES)
+
+prediction_cache = PredictionCache(
+    max_entries=Config.RESULT_CACHE_MAX_ENTRIES,
+    disk_dir=Config.RESULT_CACHE_DISK_DIR or None,
+    enabled=Config.RESULT_CACHE_ENABLED
+)
@@ -1,15 +1,156 @@
-from pymongo import MongoClient
-from bson import ObjectId
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from bson import ObjectId, json_util
 from datetime import datetime
+from pathlib import Path
 from config import Config
+from services.event_service import prediction_broker
+import atexit
+import base64
 import certifi
+import os
+import queue
 import ssl
+import threading
+import time
+
+
+class PredictionSpool:
+    """
+    Spool local append-only (JSONL) para cuando MongoDB no está disponible.
+    Cada línea es un registro en Extended JSON, con su _id ya asignado, así
+    que al drenarlo con upserts por _id no se generan duplicados.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Registros pendientes según este proceso: se cuentan una vez al
+        # arrancar y luego se actualizan en memoria (/health no relee el spool)
+        self.pending = self._count_lines()
+
+    def append(self, records):
+        lines = ''.join(json_util.dumps(r) + '\n' for r in records)
+        with self._lock:
+            # Una sola escritura en modo append para no intercalar líneas entre procesos
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                if Config.DB_SPOOL_FSYNC:
+                    os.fsync(f.fileno())
+            self.pending += len(records)
+
+    def pending_files(self):
+        """Archivos a drenar, en orden: restos de drenados anteriores y luego el spool actual"""
+        return sorted(self.path.parent.glob(f"{self.path.name}.*.draining")) + \
+            ([self.path] if self.path.exists() else [])
+
+    def claim(self, path):
+        """
+        Reclama un archivo para drenarlo en exclusiva: el spool actual se
+        renombra (las nuevas escrituras van a uno limpio) y sobre el .draining
+        se toma un flock. Devuelve (ruta, archivo con el lock) o None si otro
+        worker lo tiene. El lock se libera al cerrar el archivo; si el worker
+        muere, el sistema lo suelta y el .draining se puede reclamar de nuevo.
+        """
+        import fcntl
+
+        if path.suffix != '.draining':
+            claimed = path.with_name(f"{path.name}.{os.getpid()}_{time.time_ns()}.draining")
+            try:
+                with self._lock:
+                    path.rename(claimed)
+            except FileNotFoundError:
+                # Otro worker lo reclamó primero
+                return None
+            path = claimed
+
+        try:
+            lock = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Si otro worker lo terminó y borró mientras esperábamos, es otro inodo (o ninguno)
+            if os.fstat(lock.fileno()).st_ino != os.stat(path).st_ino:
+                raise FileNotFoundError(path)
+        except OSError:
+            lock.close()
+            return None
+        return path, lock
+
+    @staticmethod
+    def read(path, chunk_size):
+        """Lee el spool en orden, por bloques; ignora una última línea truncada"""
+        chunk = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    chunk.append(json_util.loads(line))
+                except ValueError:
+                    print(f"⚠️ Línea corrupta en {path.name}, se omite")
+                    continue
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def mark_drained(self, count):
+        with self._lock:
+            self.pending = max(0, self.pending - count)
+
+    def _count_lines(self):
+        total = 0
+        for path in self.pending_files():
+            try:
+                with open(path, 'rb') as f:
+                    total += sum(1 for _ in f)
+            except OSError:
+                pass
+        return total
+
+    def size_bytes(self):
+        """Tamaño en disco del spool (solo stat, válido entre workers)"""
+        total = 0
+        for path in self.pending_files():
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
 
 class DBService:
     def __init__(self):
         self.db = None
         self.predictions = None
+        self.spool = PredictionSpool(Config.DB_SPOOL_PATH)
+        self._reconnect_lock = threading.Lock()
+        self._reconnecting = False
+        self.spool_stats = {'spooled': 0, 'drained': 0, 'reconnects': 0}
+        self._stats = None
+        self._stats_lock = threading.Lock()
+        self._checked_shapes = set()
+        self._stats_reconciled_at = 0.0
+        self._stats_reconciling = False
         self._connect()
+        self._init_writer()
+        self._after_connect()
+
+    def _init_writer(self):
+        """Estado del escritor write-behind (el hilo arranca con el primer registro)"""
+        self._write_queue = queue.Queue(maxsize=Config.DB_WRITE_QUEUE_MAX)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._stop_writer = threading.Event()
+        self.writer_stats = {
+            'enqueued': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'flushes': 0,
+            'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0
+        }
 
     def _connect(self):
         # INTENTO 1: Conexión Segura Estándar (Recomendada)
@@ -53,42 +194,501 @@ class DBService:
     def is_connected(self):
         return self.db is not None
 
+    # --- Spool local + reconexión ---
+
+    def _after_connect(self):
+        """Si hay conexión, drena el spool pendiente; si no, empieza a reintentar"""
+        if self.is_connected():
+            self.ensure_indexes()
+            if self.spool.pending_files():
+                threading.Thread(target=self.drain_spool, name='db-spool-drain', daemon=True).start()
+        else:
+            self._start_reconnect()
+
+    def _on_connection_lost(self, error):
+        print(f"❌ Se perdió la conexión con MongoDB: {error}")
+        self.db = None
+        self.predictions = None
+        self._start_reconnect()
+
+    def _start_reconnect(self):
+        with self._reconnect_lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect_loop, name='db-reconnect', daemon=True).start()
+
+    def _reconnect_loop(self):
+        """Reintenta con backoff exponencial y, al volver, drena el spool"""
+        delay = Config.DB_RECONNECT_MIN_S
+        while not self.is_connected():
+            time.sleep(delay)
+            self._connect()
+            delay = min(delay * 2, Config.DB_RECONNECT_MAX_S)
+        self.spool_stats['reconnects'] += 1
+        with self._reconnect_lock:
+            self._reconnecting = False
+        self.ensure_indexes()
+        self.drain_spool()
+
+    def _spool(self, records):
+        try:
+            self.spool.append(records)
+            self.spool_stats['spooled'] += len(records)
+            return True
+        except OSError as e:
+            print(f"❌ No se pudo escribir en el spool local: {e}")
+            return False
+
+    def drain_spool(self):
+        """Vuelca el spool a Mongo en orden, con upserts por _id (idempotente)"""
+        for path in self.spool.pending_files():
+            claim = self.spool.claim(path)
+            if claim is None:
+                continue
+            claimed, lock = claim
+            try:
+                for chunk in self.spool.read(claimed, Config.DB_FLUSH_BATCH_SIZE):
+                    predictions = self.predictions
+                    if predictions is None:
+                        return
+                    # seq nuevo: para el delta-sync llegan ahora, no cuando se crearon
+                    self._assign_seq(predictions, chunk)
+                    predictions.bulk_write(
+                        [ReplaceOne({'_id': r['_id']}, r, upsert=True) for r in chunk],
+                        ordered=True
+                    )
+                    self.spool_stats['drained'] += len(chunk)
+                    self.spool.mark_drained(len(chunk))
+                    self._publish(chunk)
+                    # Algunos pudieron existir ya (upsert): mejor reconciliar
+                    self._invalidate_stats()
+                # Con el lock aún tomado: nadie más puede haberlo borrado
+                claimed.unlink()
+                print(f"✅ Spool {claimed.name} volcado a MongoDB")
+            except ConnectionFailure as e:
+                # El archivo reclamado se queda como .draining y se reintenta después
+                self._on_connection_lost(e)
+                return
+            except Exception as e:
+                print(f"❌ Error drenando el spool: {e}")
+                return
+            finally:
+                lock.close()
+
+    def spool_metrics(self):
+        return {
+            **self.spool_stats,
+            'pending': self.spool.pending,
+            'pending_bytes': self.spool.size_bytes(),
+            'reconnecting': self._reconnecting
+        }
+
+    # --- Escritura write-behind ---
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._writer_loop, name='db-writer', daemon=True)
+                    self._writer.start()
+
+    def _enqueue(self, record):
+        """Encola según DB_QUEUE_FULL_POLICY: block (con timeout), drop_newest o drop_oldest"""
+        policy = Config.DB_QUEUE_FULL_POLICY
+        try:
+            if policy == 'block':
+                self._write_queue.put(record, timeout=Config.DB_ENQUEUE_TIMEOUT_S)
+            else:
+                self._write_queue.put_nowait(record)
+        except queue.Full:
+            if policy == 'drop_oldest':
+                try:
+                    self._write_queue.get_nowait()
+                    self.writer_stats['dropped'] += 1
+                    self._write_queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    self.writer_stats['dropped'] += 1
+                    return False
+            else:
+                self.writer_stats['dropped'] += 1
+                print("⚠️ Cola de escritura llena, registro descartado")
+                return False
+        self.writer_stats['enqueued'] += 1
+        return True
+
+    def _writer_loop(self):
+        interval = Config.DB_FLUSH_INTERVAL_MS / 1000.0
+        while not (self._stop_writer.is_set() and self._write_queue.empty()):
+            # Esperar el primer registro y juntar hasta llenar el lote o vencer el intervalo
+            try:
+                batch = [self._write_queue.get(timeout=interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + interval
+            while len(batch) < Config.DB_FLUSH_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_batch(batch)
+
+    def _flush_batch(self, batch):
+        start = time.perf_counter()
+        predictions = self.predictions
+        try:
+            if predictions is None:
+                # Mongo caído: al spool local hasta que vuelva
+                if not self._spool(batch):
+                    self.writer_stats['failed'] += len(batch)
+                return
+            self._assign_seq(predictions, batch)
+            predictions.insert_many(batch, ordered=False)
+            self.writer_stats['written'] += len(batch)
+            self._count_written(batch)
+            self._publish(batch)
+        except BulkWriteError as e:
+            self._invalidate_stats()
+            failed = {err['index'] for err in e.details.get('writeErrors', [])}
+            self._publish([r for i, r in enumerate(batch) if i not in failed])
+            written = e.details.get('nInserted', 0)
+            self.writer_stats['written'] += written
+            self.writer_stats['failed'] += len(batch) - written
+            print(f"Error guardando lote: {e.details.get('writeErrors', [])[:1]}")
+        except ConnectionFailure as e:
+            # Parte del lote pudo llegar; el drenado usa upserts por _id, sin duplicados
+            self._on_connection_lost(e)
+            if not self._spool(batch):
+                self.writer_stats['failed'] += len(batch)
+        except Exception as e:
+            self.writer_stats['failed'] += len(batch)
+            print(f"Error guardando lote: {e}")
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats = self.writer_stats
+        stats['flushes'] += 1
+        stats['last_flush_ms'] = round(elapsed_ms, 2)
+        stats['max_flush_ms'] = round(max(stats['max_flush_ms'], elapsed_ms), 2)
+        stats['total_flush_ms'] += elapsed_ms
+
+    def shutdown(self, timeout=10.0):
+        """Vacía la cola antes de salir (atexit / worker_exit de gunicorn)"""
+        if self._writer is None:
+            return
+        self._stop_writer.set()
+        self._writer.join(timeout=timeout)
+        if self._writer.is_alive():
+            print(f"⚠️ Quedaron {self._write_queue.qsize()} registros sin guardar al salir")
+
+    def writer_metrics(self):
+        stats = dict(self.writer_stats)
+        flushes = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = round(flushes / stats['flushes'], 2) if stats['flushes'] else 0.0
+        stats['queue_depth'] = self._write_queue.qsize()
+        stats['queue_max'] = Config.DB_WRITE_QUEUE_MAX
+        stats['policy'] = Config.DB_QUEUE_FULL_POLICY
+        return stats
+
+    def _prepare(self, data, now=None):
+        # El _id se asigna aquí para poder devolverlo sin esperar a Mongo
+        data['timestamp'] = now or datetime.utcnow()
+        data.setdefault('_id', ObjectId())
+        return data
+
+    def _assign_seq(self, predictions, records):
+        """
+        Numera los registros en orden de escritura (contador atómico en Mongo,
+        un rango por lote). El delta-sync usa seq y no timestamp: un registro
+        que llega tarde (drenado del spool, lote de otro worker) conserva su
+        timestamp original pero recibe un seq mayor que lo ya visto.
+        """
+        counter = predictions.database['counters'].find_one_and_update(
+            {'_id': 'predictions_seq'},
+            {'$inc': {'seq': len(records)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        first = counter['seq'] - len(records) + 1
+        for offset, record in enumerate(records):
+            record['seq'] = first + offset
+
+    def _publish(self, records):
+        """
+        Avisa a /predictions/stream (no bloquea). Solo se publica lo que ya
+        está en Mongo, así todo id enviado se puede resolver con Last-Event-ID.
+        """
+        for r in records:
+            prediction_broker.publish(r)
+
     def save_prediction(self, data):
-        if self.predictions is not None:
+        ids = self.save_predictions([data])
+        return ids[0] if ids else None
+
+    def save_predictions(self, records):
+        """
+        Guarda uno o varios registros: cola write-behind (o insert_many directo
+        si DB_WRITE_BEHIND=false) y, si Mongo no responde, el spool local.
+        """
+        if not records:
+            return []
+        now = datetime.utcnow()
+        records = [self._prepare(data, now) for data in records]
+        ids = [str(r['_id']) for r in records]
+
+        if self.predictions is None:
+            return ids if self._spool(records) else []
+
+        if not Config.DB_WRITE_BEHIND:
             try:
-                data['timestamp'] = datetime.utcnow()
-                result = self.predictions.insert_one(data)
-                return str(result.inserted_id)
+                self._assign_seq(self.predictions, records)
+                self.predictions.insert_many(records, ordered=True)
+                self._count_written(records)
+                self._publish(records)
+                return ids
+            except ConnectionFailure as e:
+                self._on_connection_lost(e)
+                return ids if self._spool(records) else []
             except Exception as e:
                 print(f"Error guardando: {e}")
-        return None
+                return []
+
+        self._ensure_writer()
+        return [str(r['_id']) for r in records if self._enqueue(r)]
+
+    # --- Índices ---
+
+    # Índices que necesitan las consultas del historial (nombre -> claves)
+    # (_id desempata el orden y permite la paginación por cursor sin SORT en memoria)
+    INDEXES = {
+        'timestamp_id_desc': [('timestamp', DESCENDING), ('_id', DESCENDING)],
+        'type_timestamp_id': [('type', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+        'model_timestamp_id': [('model', ASCENDING), ('timestamp', DESCENDING), ('_id', DESCENDING)],
+        # Delta-sync (?since=) por orden de escritura
+        'seq_desc': [('seq', DESCENDING)],
+    }
 
-    def get_all_predictions(self, limit=50, filters=None):
-        if self.predictions is None: return []
-        query = filters if filters else {}
+    def ensure_indexes(self):
+        """Crea (idempotente) y verifica los índices de la colección predictions"""
+        predictions = self.predictions
+        if predictions is None:
+            return
         try:
-            cursor = self.predictions.find(query).sort('timestamp', -1).limit(limit)
-            results = []
-            for doc in cursor:
-                doc['_id'] = str(doc['_id'])
-                results.append(doc)
-            return results
-        except:
-            return []
-    
+            for name, keys in self.INDEXES.items():
+                predictions.create_index(keys, name=name, background=True)
+            existing = predictions.index_information()
+            missing = [name for name in self.INDEXES if name not in existing]
+            if missing:
+                print(f"⚠️ Índices que no se pudieron verificar: {missing}")
+            else:
+                print(f"✅ Índices verificados: {', '.join(self.INDEXES)}")
+        except Exception as e:
+            print(f"⚠️ No se pudieron crear los índices: {e}")
+
+    def _check_query_plan(self, query, cursor):
+        """
+        Registra (una vez por forma de consulta) las que no usan índice:
+        COLLSCAN o SORT en memoria en el plan ganador.
+        """
+        shape = tuple(sorted(query.keys()))
+        if shape in self._checked_shapes:
+            return
+        self._checked_shapes.add(shape)
+        try:
+            plan = cursor.explain().get('queryPlanner', {}).get('winningPlan', {})
+            stages = []
+            while plan:
+                stages.append(plan.get('stage'))
+                plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+            if 'COLLSCAN' in stages or 'SORT' in stages:
+                print(f"⚠️ Consulta sin índice {shape or '(sin filtros)'}: plan {' <- '.join(filter(None, stages))}")
+        except Exception as e:
+            print(f"⚠️ No se pudo obtener el plan de la consulta: {e}")
+
+    # --- Paginación por cursor (keyset sobre timestamp, _id) ---
+
+    # Campos que se pueden pedir con ?fields=; los alias apuntan a rutas anidadas
+    PROJECTABLE_FIELDS = {'type', 'model', 'models', 'timestamp', 'image_path', 'result'}
+    FIELD_ALIASES = {
+        'top_class': ['result.top_class'],
+        'confidence': ['result.top_confidence'],
+        'thumbnail': ['image_path', 'result.result_image'],
+    }
+
+    @staticmethod
+    def encode_cursor(doc):
+        raw = f"{doc['timestamp'].isoformat()}|{doc['_id']}"
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def encode_seq_cursor(doc):
+        return base64.urlsafe_b64encode(f"seq|{doc['seq']}".encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_seq_cursor(token):
+        """Cursor de una página de delta (orden por seq); lanza ValueError si no es válido"""
+        try:
+            kind, seq = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').split('|', 1)
+            if kind != 'seq':
+                raise ValueError
+            return int(seq)
+        except Exception:
+            raise ValueError('Cursor inválido')
+
+    @staticmethod
+    def decode_cursor(token):
+        """Lanza ValueError si el cursor no es válido"""
+        try:
+            raw = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+            ts, oid = raw.split('|', 1)
+            return datetime.fromisoformat(ts), ObjectId(oid)
+        except Exception:
+            raise ValueError('Cursor inválido')
+
+    def build_projection(self, fields):
+        """Traduce ?fields= a una proyección de Mongo (None = documento completo)"""
+        if not fields:
+            return None
+        projection = {'_id': 1, 'timestamp': 1, 'seq': 1}
+        for field in fields:
+            if field in self.FIELD_ALIASES:
+                for path in self.FIELD_ALIASES[field]:
+                    projection[path] = 1
+            elif field.split('.', 1)[0] in self.PROJECTABLE_FIELDS:
+                projection[field] = 1
+            else:
+                raise ValueError(f"Campo no permitido: {field}")
+        # Si se pide 'result' entero, sobran sus subcampos (Mongo no permite ambos)
+        if 'result' in projection:
+            projection = {k: v for k, v in projection.items() if not k.startswith('result.')}
+        return projection
+
+    def resolve_since(self, since_id):
+        """
+        seq del último registro que vio el cliente, o None si no existe
+        (o es anterior a seq): en ese caso el cliente debe recargar todo.
+        """
+        try:
+            oid = ObjectId(since_id)
+        except Exception:
+            return None
+        doc = self.predictions.find_one({'_id': oid}, {'seq': 1})
+        return doc.get('seq') if doc else None
+
+    def collection_version(self):
+        """
+        Huella barata del estado de la colección para ETags: el registro más
+        reciente (por índice) y el conteo estimado (metadatos, O(1)).
+        Es válida entre workers porque se lee de Mongo.
+        """
+        latest = self.predictions.find_one(
+            {}, {'_id': 1}, sort=[('timestamp', DESCENDING), ('_id', DESCENDING)]
+        )
+        return f"{latest['_id'] if latest else '-'}:{self.predictions.estimated_document_count()}"
+
+    def get_predictions_page(self, limit=50, filters=None, cursor=None, fields=None, since=None):
+        """
+        Una página del historial, de más reciente a más antiguo.
+        since=seq (ver resolve_since) limita el resultado a lo escrito después
+        de ese registro, ordenado por seq en lugar de timestamp.
+        Devuelve (registros, next_cursor); next_cursor es None en la última página.
+        """
+        if self.predictions is None: return [], None
+        query = dict(filters) if filters else {}
+        conditions = []
+        sort = [('timestamp', DESCENDING), ('_id', DESCENDING)]
+        encode = self.encode_cursor
+        if since is not None:
+            sort = [('seq', DESCENDING)]
+            encode = self.encode_seq_cursor
+            conditions.append({'seq': {'$gt': since}})
+            if cursor:
+                conditions.append({'seq': {'$lt': self.decode_seq_cursor(cursor)}})
+        elif cursor:
+            ts, oid = self.decode_cursor(cursor)
+            conditions.append({'$or': [
+                {'timestamp': {'$lt': ts}},
+                {'timestamp': ts, '_id': {'$lt': oid}}
+            ]})
+        if len(conditions) == 1:
+            query.update(conditions[0])
+        elif conditions:
+            query['$and'] = conditions
+
+        projection = self.build_projection(fields)
+        find_cursor = self.predictions.find(query, projection).sort(sort).limit(limit + 1)
+        if Config.DB_CHECK_QUERY_PLANS:
+            self._check_query_plan(query, find_cursor.clone())
+
+        docs = list(find_cursor)
+        next_cursor = encode(docs[limit - 1]) if len(docs) > limit else None
+        results = []
+        for doc in docs[:limit]:
+            doc['_id'] = str(doc['_id'])
+            results.append(doc)
+        return results, next_cursor
+
+    # --- Estadísticas: contadores en memoria + reconciliación periódica ---
+
+    def _count_written(self, records):
+        """Suma al contador en memoria los registros que ya llegaron a Mongo"""
+        with self._stats_lock:
+            if self._stats is None:
+                return
+            self._stats['total'] += len(records)
+            for r in records:
+                pred_type = r.get('type', 'unknown')
+                self._stats['by_type'][pred_type] = self._stats['by_type'].get(pred_type, 0) + 1
+
+    def _invalidate_stats(self):
+        """Fuerza una reconciliación (escrituras parciales o upserts de conteo incierto)"""
+        with self._stats_lock:
+            self._stats_reconciled_at = 0.0
+
+    def reconcile_stats(self):
+        """Recalcula total y conteo por tipo con una sola agregación $group"""
+        predictions = self.predictions
+        if predictions is None:
+            return
+        by_type = {'classification': 0, 'segmentation': 0, 'comparison': 0}
+        for row in predictions.aggregate([{'$group': {'_id': '$type', 'count': {'$sum': 1}}}]):
+            by_type[row['_id'] or 'unknown'] = row['count']
+        with self._stats_lock:
+            self._stats = {'total': sum(by_type.values()), 'by_type': by_type}
+            self._stats_reconciled_at = time.monotonic()
+
+    def _reconcile_in_background(self):
+        with self._stats_lock:
+            if self._stats_reconciling:
+                return
+            self._stats_reconciling = True
+
+        def run():
+            try:
+                self.reconcile_stats()
+            except Exception as e:
+                print(f"Error reconciliando stats: {e}")
+            finally:
+                with self._stats_lock:
+                    self._stats_reconciling = False
+
+        threading.Thread(target=run, name='db-stats', daemon=True).start()
+
     def get_stats(self):
         if self.predictions is None: return {}
         try:
-            return {
-                'total': self.predictions.count_documents({}),
-                'by_type': {
-                    'classification': self.predictions.count_documents({'type': 'classification'}),
-                    'segmentation': self.predictions.count_documents({'type': 'segmentation'}),
-                    'comparison': self.predictions.count_documents({'type': 'comparison'})
-                }
-            }
+            # Solo la primera vez se espera a la agregación; después se sirve de memoria
+            if self._stats is None:
+                self.reconcile_stats()
+            elif time.monotonic() - self._stats_reconciled_at > Config.DB_STATS_RECONCILE_S:
+                self._reconcile_in_background()
+            with self._stats_lock:
+                return {'total': self._stats['total'], 'by_type': dict(self._stats['by_type'])}
         except:
             return {}
 
 # Instancia Singleton
-db_service = DBService()
\ No newline at end of file
+db_service = DBService()
+atexit.register(db_service.shutdown)
\ No newline at end of file
@@ -0,0 +1,102 @@
+import json
+import queue
+import threading
+from config import Config
+
+
+class Subscriber:
+    """Un cliente SSE: buffer acotado + filtros opcionales por tipo y modelo"""
+    def __init__(self, pred_type=None, model=None, buffer_size=100):
+        self.pred_type = pred_type
+        self.model = model
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+    def matches(self, event):
+        if self.pred_type and event.get('type') != self.pred_type:
+            return False
+        if self.model and event.get('model') != self.model and self.model not in (event.get('models') or []):
+            return False
+        return True
+
+
+class PredictionBroker:
+    """
+    Pub/sub en proceso para las predicciones nuevas. publish() nunca
+    bloquea: si el buffer de un suscriptor se llena, se le desconecta
+    (slow consumer) en lugar de frenar a quien escribe.
+    Nota: con varios workers de gunicorn cada uno solo ve sus propias predicciones.
+    """
+    def __init__(self, buffer_size=100, max_subscribers=20):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.counters = {'published': 0, 'delivered': 0, 'slow_consumers_dropped': 0}
+
+    def subscribe(self, pred_type=None, model=None):
+        """Devuelve un Subscriber, o None si se alcanzó el máximo de conexiones"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(pred_type, model, self.buffer_size)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, record):
+        event = to_event(record)
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.counters['published'] += 1
+
+        for subscriber in subscribers:
+            if subscriber.dropped or not subscriber.matches(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                self.counters['delivered'] += 1
+            except queue.Full:
+                # Cliente atascado: se le corta para no acumular memoria
+                subscriber.dropped = True
+                self.unsubscribe(subscriber)
+                self.counters['slow_consumers_dropped'] += 1
+                try:
+                    subscriber.queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), **self.counters}
+
+
+def to_event(record):
+    """Resumen serializable de un registro de predicción"""
+    timestamp = record.get('timestamp')
+    return {
+        '_id': str(record.get('_id')),
+        'type': record.get('type'),
+        'model': record.get('model'),
+        'models': record.get('models'),
+        'timestamp': timestamp.isoformat() if timestamp else None,
+        'result': record.get('result')
+    }
+
+
+def format_sse(event, event_id=None, event_name='prediction'):
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_name}")
+    lines.append(f"data: {json.dumps(event, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+# Instancia Singleton
+prediction_broker = PredictionBroker(
+    buffer_size=Config.SSE_BUFFER_SIZE,
+    max_subscribers=Config.SSE_MAX_SUBSCRIBERS
+)
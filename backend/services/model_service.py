@@ -1,25 +1,29 @@
+import gc
 import json
+import queue
+import threading
+import time
 import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from pathlib import Path
 from PIL import Image
-from config import MODELS_DIR
+from config import MODELS_DIR, Config
+from utils.file_helpers import open_image, unique_temp_path
 
 # Importamos TensorFlow/Keras solo cuando se necesitan (dentro de las funciones o clases)
 # para no saturar la memoria al inicio.
 
-class ClassificationModel:
-    def __init__(self, model_path, config_path):
-        from tensorflow import keras
-        from tensorflow.keras.applications.resnet50 import preprocess_input as resnet_preprocess
-        from tensorflow.keras.applications.mobilenet_v2 import preprocess_input as mobilenet_preprocess
-        from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess
+def decode_image(source):
+    """Decodifica una imagen (ruta o bytes en memoria) a RGB, una sola vez por petición"""
+    return open_image(source).convert('RGB')
 
-        self.PREPROCESS_MAP = {
-            'resnet50': resnet_preprocess,
-            'mobilenetv2': mobilenet_preprocess,
-            'efficientnetb2': efficientnet_preprocess,
-        }
 
+class ClassificationModel:
+    """Clasificador servido con Keras (backend por defecto)"""
+    backend = 'keras'
+
+    def __init__(self, model_path, config_path):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
             
@@ -28,22 +32,49 @@ class ClassificationModel:
         self.classes = self.config['classes']
         self.idx_to_class = {v: k for k, v in self.config['class_indices'].items()}
         
-        self.preprocess_fn = self.PREPROCESS_MAP.get(self.model_name, lambda x: x / 255.0)
+        self.preprocess_fn = self._get_preprocess_fn()
         
-        print(f"⏳ Cargando modelo {self.model_name} en memoria...")
-        self.model = keras.models.load_model(str(model_path))
-        # self.model.compile() # Omitimos compile para ahorrar tiempo/memoria en carga
+        print(f"⏳ Cargando modelo {self.model_name} en memoria ({self.backend})...")
+        self.model_file = Path(model_path)
+        self.model = self._load_model(self.model_file)
         print(f"✅ {self.model_name} listo!")
+
+    def _get_preprocess_fn(self):
+        from tensorflow.keras.applications.resnet50 import preprocess_input as resnet_preprocess
+        from tensorflow.keras.applications.mobilenet_v2 import preprocess_input as mobilenet_preprocess
+        from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess
+
+        self.PREPROCESS_MAP = {
+            'resnet50': resnet_preprocess,
+            'mobilenetv2': mobilenet_preprocess,
+            'efficientnetb2': efficientnet_preprocess,
+        }
+        return self.PREPROCESS_MAP.get(self.model_name, lambda x: x / 255.0)
+
+    def _load_model(self, model_path):
+        from tensorflow import keras
+        model = keras.models.load_model(str(model_path))
+        # model.compile() # Omitimos compile para ahorrar tiempo/memoria en carga
+        return model
+
+    def _forward(self, batch):
+        return self.model.predict(batch, batch_size=len(batch), verbose=0)
         
-    def predict(self, image_path, top_k=3):
-        img = Image.open(str(image_path)).convert('RGB')
+    def load_image(self, source):
+        """Abre una imagen (ruta o bytes) y la deja en float32 con el tamaño que espera el modelo"""
+        return self.resize_image(decode_image(source))
+
+    def resize_array(self, img_array):
+        """Igual que resize_image pero desde un ndarray RGB uint8 (p.ej. un recorte)"""
+        return self.resize_image(Image.fromarray(img_array))
+
+    def resize_image(self, img):
+        """Redimensiona una imagen PIL ya decodificada al img_size del modelo"""
         img = img.resize(self.img_size, Image.BILINEAR)
-        img_array = np.array(img, dtype=np.float32)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_preprocessed = self.preprocess_fn(img_array)
-        
-        predictions = self.model.predict(img_preprocessed, verbose=0)[0]
-        
+        return np.array(img, dtype=np.float32)
+
+    def format_predictions(self, predictions, top_k=3):
+        """Convierte un vector de probabilidades en el top-k que devuelve la API"""
         top_indices = np.argsort(predictions)[::-1][:top_k]
         results = []
         for idx in top_indices:
@@ -59,53 +90,622 @@ class ClassificationModel:
             'top_confidence': results[0]['confidence']
         }
 
+    def predict_arrays(self, img_arrays):
+        """Un solo forward pass para un lote de imágenes ya redimensionadas"""
+        # np.stack copia los datos, así preprocess_fn nunca modifica el buffer
+        # original (que puede estar compartido entre varios modelos)
+        batch = np.stack(img_arrays, axis=0)
+        img_preprocessed = self.preprocess_fn(batch)
+        return self._forward(img_preprocessed)
+
+    def predict(self, source, top_k=3):
+        img_array = self.load_image(source)
+        predictions = self.predict_arrays([img_array])[0]
+        return self.format_predictions(predictions, top_k=top_k)
+
+
+# Equivalentes en NumPy de keras.applications.*.preprocess_input, para que el
+# backend ONNX no tenga que importar TensorFlow en cada worker
+def _caffe_preprocess(x):
+    # RGB -> BGR y resta de la media de ImageNet
+    x = x[..., ::-1]
+    return x - np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+NUMPY_PREPROCESS_MAP = {
+    'resnet50': _caffe_preprocess,
+    'mobilenetv2': lambda x: x / 127.5 - 1.0,
+    'efficientnetb2': lambda x: x,  # EfficientNet normaliza dentro del grafo
+}
+
+
+class OnnxClassificationModel(ClassificationModel):
+    """
+    Clasificador servido con onnxruntime. El .keras se convierte a ONNX la
+    primera vez y el resultado se guarda junto al original (<modelo>.onnx).
+    """
+    backend = 'onnx'
+
+    def _get_preprocess_fn(self):
+        return NUMPY_PREPROCESS_MAP.get(self.model_name, lambda x: x / 255.0)
+
+    def _load_model(self, model_path):
+        import onnxruntime as ort
+
+        onnx_path = self.onnx_path(model_path)
+        if self._needs_conversion(model_path, onnx_path):
+            # Un solo worker convierte; los demás esperan el lock y usan su resultado
+            import fcntl
+            with open(onnx_path.with_name(onnx_path.name + '.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if self._needs_conversion(model_path, onnx_path):
+                    self.convert_to_onnx(model_path, onnx_path)
+
+        options = ort.SessionOptions()
+        if Config.ONNX_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = Config.ONNX_INTRA_OP_THREADS
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.model_file = onnx_path
+        session = ort.InferenceSession(str(onnx_path), options, providers=['CPUExecutionProvider'])
+        self.input_name = session.get_inputs()[0].name
+        return session
+
+    def _forward(self, batch):
+        return self.model.run(None, {self.input_name: batch.astype(np.float32, copy=False)})[0]
+
+    @staticmethod
+    def _needs_conversion(model_path, onnx_path):
+        return not onnx_path.exists() or onnx_path.stat().st_mtime < model_path.stat().st_mtime
+
+    @staticmethod
+    def onnx_path(model_path):
+        return Path(model_path).with_suffix('.onnx')
+
+    def convert_to_onnx(self, model_path, onnx_path):
+        """Conversión única .keras/.h5 -> .onnx (requiere TensorFlow y tf2onnx)"""
+        import tensorflow as tf
+        import tf2onnx
+        from tensorflow import keras
+
+        print(f"🔁 Convirtiendo {model_path.name} a ONNX...")
+        keras_model = keras.models.load_model(str(model_path), compile=False)
+        spec = (tf.TensorSpec((None,) + self.img_size + (3,), tf.float32, name='input'),)
+
+        @tf.function(input_signature=spec)
+        def serve(x):
+            return keras_model(x, training=False)
+
+        # Temporal propio y rename: nunca queda un .onnx a medias con el nombre final
+        tmp_path = unique_temp_path(onnx_path)
+        try:
+            tf2onnx.convert.from_function(serve, input_signature=spec, opset=13, output_path=str(tmp_path))
+            tmp_path.replace(onnx_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        del keras_model
+        gc.collect()
+        print(f"✅ ONNX guardado en {onnx_path}")
+
+
+class TFLiteClassificationModel(ClassificationModel):
+    """
+    Variantes cuantizadas (int8 dinámico / float16) generadas con
+    scripts/quantize_models.py y servidas con el intérprete de TFLite.
+    """
+    backend = 'tflite'
+
+    def _get_preprocess_fn(self):
+        return NUMPY_PREPROCESS_MAP.get(self.model_name, lambda x: x / 255.0)
+
+    def _load_model(self, model_path):
+        import tensorflow as tf
+
+        threads = Config.INFERENCE_THREADS if Config.INFERENCE_THREADS > 0 else None
+        interpreter = tf.lite.Interpreter(model_path=str(model_path), num_threads=threads)
+        interpreter.allocate_tensors()
+        self._input_index = interpreter.get_input_details()[0]['index']
+        self._output_index = interpreter.get_output_details()[0]['index']
+        self._batch_size = 1
+        # El intérprete no es thread-safe
+        self._interpreter_lock = threading.Lock()
+        return interpreter
+
+    def _forward(self, batch):
+        batch = batch.astype(np.float32, copy=False)
+        with self._interpreter_lock:
+            if batch.shape[0] != self._batch_size:
+                self.model.resize_tensor_input(self._input_index, batch.shape)
+                self.model.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self.model.set_tensor(self._input_index, batch)
+            self.model.invoke()
+            return self.model.get_tensor(self._output_index).copy()
+
+
+# Backend seleccionable por modelo con la clave "backend" de su config.json
+BACKENDS = {
+    'keras': ClassificationModel,
+    'onnx': OnnxClassificationModel,
+    'tflite': TFLiteClassificationModel,
+}
+
+
+def load_classification_model(model_file, config_file):
+    """Instancia el clasificador con el backend indicado en config.json"""
+    with open(config_file, 'r') as f:
+        backend = json.load(f).get('backend', 'keras')
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido '{backend}' en {config_file}")
+    return BACKENDS[backend](model_file, config_file)
+
+
+class SchedulerClosed(RuntimeError):
+    """El scheduler se cerró (modelo expulsado): pedir uno nuevo y reintentar"""
+
+
+class BatchScheduler:
+    """
+    Micro-batching: junta las peticiones concurrentes de un mismo modelo
+    durante unos milisegundos (o hasta llenar el lote) y las resuelve con
+    un único model.predict.
+    """
+    def __init__(self, model, max_batch_size=16, max_wait_ms=10, max_queue_size=256):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        # Protege _closed y el encolado: nada entra después de la señal de cierre
+        self._submit_lock = threading.Lock()
+
+        # Métricas de ocupación de los lotes
+        self._stats_lock = threading.Lock()
+        self.batches_run = 0
+        self.items_processed = 0
+        self.max_batch_seen = 0
+
+        self._worker = threading.Thread(
+            target=self._run, name=f"batcher-{model.model_name}", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, img_array, top_k=3, timeout=None):
+        """
+        Encola una imagen y espera su resultado.
+        Lanza queue.Full si la cola está llena (el llamador decide qué responder)
+        y SchedulerClosed si el modelo fue expulsado.
+        """
+        future = Future()
+        with self._submit_lock:
+            if self._closed:
+                raise SchedulerClosed(f"El modelo {self.model.model_name} fue descargado de memoria")
+            self.queue.put_nowait((img_array, top_k, future))
+        return future.result(timeout=timeout)
+
+    def close(self):
+        """Detiene el worker tras terminar lo que ya está en cola"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+        # Fuera del lock: put puede bloquear hasta que el worker libere sitio
+        self.queue.put(None)
+
+    def _collect_batch(self):
+        # Bloquea hasta el primer elemento y luego espera como máximo max_wait.
+        # None es la señal de cierre.
+        first = self.queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                predictions = self.model.predict_arrays([item[0] for item in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                predictions = []
+            # Cada petición se resuelve por separado: un fallo al formatear no afecta al resto
+            for (_, top_k, future), probs in zip(batch, predictions):
+                try:
+                    future.set_result(self.model.format_predictions(probs, top_k=top_k))
+                except Exception as e:
+                    future.set_exception(e)
+
+            with self._stats_lock:
+                self.batches_run += 1
+                self.items_processed += len(batch)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+        # Peticiones que llegaron justo después del cierre
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(SchedulerClosed("Scheduler cerrado"))
+
+    def stats(self):
+        with self._stats_lock:
+            avg = self.items_processed / self.batches_run if self.batches_run else 0.0
+            return {
+                'batches_run': self.batches_run,
+                'items_processed': self.items_processed,
+                'avg_batch_size': round(avg, 2),
+                'max_batch_seen': self.max_batch_seen,
+                'avg_batch_fill': round(avg / self.max_batch_size, 3),
+                'queue_depth': self.queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0
+            }
+
+def configure_inference_threads(num_threads):
+    """Fija los hilos intra-op de TF/torch del proceso actual (0 = no tocar)"""
+    if num_threads <= 0:
+        return
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception as e:
+        # TF no permite cambiarlo si el runtime ya se inicializó
+        print(f"⚠️ No se pudieron fijar los hilos de TensorFlow: {e}")
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except Exception as e:
+        print(f"⚠️ No se pudieron fijar los hilos de torch: {e}")
+
+
+def estimate_model_bytes(model, model_file=None):
+    """
+    Tamaño aproximado en RAM de un modelo: bytes de sus parámetros,
+    o el tamaño del archivo en disco si no se pueden contar.
+    """
+    size = 0
+    try:
+        if hasattr(model, 'count_params'):
+            # Keras: los pesos son float32
+            size = int(model.count_params()) * 4
+        elif hasattr(model, 'model') and hasattr(model.model, 'parameters'):
+            # Ultralytics/torch
+            size = sum(p.numel() * p.element_size() for p in model.model.parameters())
+    except Exception:
+        size = 0
+    if model_file is not None and Path(model_file).exists():
+        size = max(size, Path(model_file).stat().st_size)
+    return size
+
+
 class ModelManager:
+    SEGMENTATION_KEY = 'yolo'
+
     def __init__(self):
         # NO cargamos nada al inicio
         self.classification_models = {} 
         self.segmentation_model = None
+        self.batch_schedulers = {}
+        self._scheduler_lock = threading.Lock()
+
+        # Presupuesto de memoria: orden LRU (nombre -> bytes estimados)
+        self.memory_budget = int(Config.MODEL_MEMORY_BUDGET_MB * 1024 * 1024)
+        self._lru = OrderedDict()
+        self._size_hints = {}
+        self._lru_lock = threading.RLock()
+        self.counters = {'loads': 0, 'reloads': 0, 'evictions': 0}
+
+        # Single-flight: un Future por modelo en carga + errores recientes
+        self._loading = {}
+        self._load_errors = {}
+        self._load_lock = threading.Lock()
+        self._loader_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='model-loader')
+
+        # Precarga + warm-up (readiness)
+        self.ready = threading.Event()
+        self.ready.set()
+        self.preload_status = {}
         print("⚡ ModelManager iniciado (Modo Lazy Loading)")
 
-    def get_classification_model(self, model_name):
-        """Carga el modelo solo si no está en memoria"""
-        if model_name not in self.classification_models:
-            print(f"⚠️ El modelo {model_name} no está en memoria. Cargándolo ahora...")
-            
-            # Buscar archivos
-            path = MODELS_DIR / model_name
-            # Buscar .h5 o .keras
-            model_file = next(path.glob("*.h5"), next(path.glob("*.keras"), None))
-            config_file = path / 'config.json'
+    # --- Contabilidad de memoria / LRU ---
 
-            if model_file and config_file.exists():
-                try:
-                    self.classification_models[model_name] = ClassificationModel(model_file, config_file)
-                except Exception as e:
-                    print(f"❌ Error cargando {model_name}: {e}")
-                    return None
+    def _touch(self, name):
+        with self._lru_lock:
+            if name in self._lru:
+                self._lru.move_to_end(name)
+
+    def _used_bytes(self):
+        return sum(self._lru.values())
+
+    def _make_room(self, incoming_bytes, keep=None):
+        """Expulsa modelos LRU hasta que incoming_bytes quepa en el presupuesto"""
+        if self.memory_budget <= 0:
+            return
+        with self._lru_lock:
+            for name in list(self._lru.keys()):
+                if self._used_bytes() + incoming_bytes <= self.memory_budget:
+                    break
+                if name == keep:
+                    continue
+                self._evict(name)
+
+    def _evict(self, name):
+        with self._lru_lock:
+            size = self._lru.pop(name, 0)
+            if name == self.SEGMENTATION_KEY:
+                self.segmentation_model = None
             else:
-                print(f"❌ Archivos de {model_name} no encontrados")
+                self.classification_models.pop(name, None)
+                with self._scheduler_lock:
+                    scheduler = self.batch_schedulers.pop(name, None)
+                if scheduler is not None:
+                    scheduler.close()
+            self.counters['evictions'] += 1
+        gc.collect()
+        print(f"♻️ Modelo {name} expulsado de memoria (~{size / 1024 / 1024:.0f} MB)")
+
+    def _register(self, name, model, model_file):
+        """Anota un modelo recién cargado y ajusta el presupuesto"""
+        size = estimate_model_bytes(model, model_file)
+        with self._lru_lock:
+            if name in self._size_hints:
+                self.counters['reloads'] += 1
+            self.counters['loads'] += 1
+            self._size_hints[name] = size
+            self._lru[name] = size
+            self._lru.move_to_end(name)
+            # La estimación previa pudo quedarse corta
+            self._make_room(0, keep=name)
+
+    def _expected_bytes(self, name, model_file):
+        if name in self._size_hints:
+            return self._size_hints[name]
+        return Path(model_file).stat().st_size if model_file and Path(model_file).exists() else 0
+
+    def memory_stats(self):
+        with self._lru_lock:
+            return {
+                'budget_mb': round(self.memory_budget / 1024 / 1024, 1),
+                'used_mb': round(self._used_bytes() / 1024 / 1024, 1),
+                'resident': {n: round(b / 1024 / 1024, 1) for n, b in self._lru.items()},
+                **self.counters
+            }
+
+    # --- Carga de modelos (single-flight) ---
+
+    def _single_flight(self, name, loader):
+        """
+        Garantiza un único loader por modelo: los llamadores concurrentes
+        esperan el mismo Future. Un fallo se recuerda durante
+        MODEL_LOAD_BACKOFF_S para no reintentar la carga en cada petición.
+        """
+        with self._load_lock:
+            error = self._load_errors.get(name)
+            if error and error[1] > time.monotonic():
+                print(f"⏸️ {name} falló hace poco, no se reintenta todavía: {error[0]}")
                 return None
+            future = self._loading.get(name)
+            if future is None:
+                future = self._loader_pool.submit(self._run_loader, name, loader)
+                self._loading[name] = future
+
+        try:
+            return future.result(timeout=Config.MODEL_LOAD_TIMEOUT_S)
+        except FutureTimeoutError:
+            # La carga sigue en segundo plano; si termina bien borra este error.
+            # Mientras tanto no se vuelve a esperar el timeout completo.
+            message = f"Timeout esperando la carga de {name} ({Config.MODEL_LOAD_TIMEOUT_S}s)"
+            print(f"⌛ {message}")
+            with self._load_lock:
+                if name in self._loading:
+                    self._load_errors[name] = (message, time.monotonic() + Config.MODEL_LOAD_BACKOFF_S)
+            return None
+        except Exception:
+            # El error ya quedó registrado en _run_loader
+            return None
+
+    def _run_loader(self, name, loader):
+        try:
+            model = loader()
+            with self._load_lock:
+                self._load_errors.pop(name, None)
+            return model
+        except Exception as e:
+            message = f"Error cargando {name}: {e}"
+            print(f"❌ {message}")
+            with self._load_lock:
+                self._load_errors[name] = (message, time.monotonic() + Config.MODEL_LOAD_BACKOFF_S)
+            raise
+        finally:
+            with self._load_lock:
+                self._loading.pop(name, None)
+
+    def load_error(self, name):
+        """Último error de carga de un modelo (si sigue dentro del backoff)"""
+        with self._load_lock:
+            error = self._load_errors.get(name)
+            if error and error[1] > time.monotonic():
+                return error[0]
+        return None
+
+    def _load_classification(self, model_name):
+        # Otro hilo pudo terminar la carga justo antes
+        if model_name in self.classification_models:
+            return self.classification_models[model_name]
+
+        print(f"⚠️ El modelo {model_name} no está en memoria. Cargándolo ahora...")
         
-        return self.classification_models[model_name]
+        # Buscar archivos
+        path = MODELS_DIR / model_name
+        # Buscar .h5 o .keras (o .tflite en variantes cuantizadas, p.ej. mobilenetv2-int8)
+        model_file = next(path.glob("*.h5"), next(path.glob("*.keras"), next(path.glob("*.tflite"), None)))
+        config_file = path / 'config.json'
+
+        if not model_file or not config_file.exists():
+            raise FileNotFoundError(f"Archivos de {model_name} no encontrados")
+
+        self._make_room(self._expected_bytes(model_name, model_file))
+        model = load_classification_model(model_file, config_file)
+        self.classification_models[model_name] = model
+        self._register(model_name, model.model, model.model_file)
+        return model
+
+    def get_classification_model(self, model_name):
+        """Carga el modelo solo si no está en memoria"""
+        model = self.classification_models.get(model_name)
+        if model is None:
+            model = self._single_flight(model_name, lambda: self._load_classification(model_name))
+        if model is not None:
+            self._touch(model_name)
+        return model
+
+    def get_batch_scheduler(self, model_name):
+        """Devuelve (o crea) el scheduler de micro-batching de un modelo"""
+        model = self.get_classification_model(model_name)
+        if model is None:
+            return None
+        with self._scheduler_lock:
+            scheduler = self.batch_schedulers.get(model_name)
+            if scheduler is None or scheduler.model is not model:
+                scheduler = BatchScheduler(
+                    model,
+                    max_batch_size=Config.BATCH_MAX_SIZE,
+                    max_wait_ms=Config.BATCH_MAX_WAIT_MS,
+                    max_queue_size=Config.BATCH_MAX_QUEUE
+                )
+                self.batch_schedulers[model_name] = scheduler
+            return scheduler
+
+    def batching_stats(self):
+        with self._scheduler_lock:
+            schedulers = dict(self.batch_schedulers)
+        return {name: s.stats() for name, s in schedulers.items()}
+
+    def _load_segmentation(self):
+        if self.segmentation_model is not None:
+            return self.segmentation_model
+
+        print("⚠️ YOLO no está en memoria. Cargándolo ahora...")
+        from ultralytics import YOLO
+        yolo_path = MODELS_DIR / 'yolo' / 'tomato_segmentation' / 'weights' / 'best.pt'
+        if not yolo_path.exists():
+            raise FileNotFoundError("Pesos de YOLO no encontrados")
+
+        self._make_room(self._expected_bytes(self.SEGMENTATION_KEY, yolo_path))
+        self.segmentation_model = YOLO(str(yolo_path))
+        self._register(self.SEGMENTATION_KEY, self.segmentation_model, yolo_path)
+        print("✅ YOLO cargado")
+        return self.segmentation_model
 
     def get_segmentation_model(self):
         """Carga YOLO solo si se necesita"""
-        if self.segmentation_model is None:
-            print("⚠️ YOLO no está en memoria. Cargándolo ahora...")
-            try:
-                from ultralytics import YOLO
-                yolo_path = MODELS_DIR / 'yolo' / 'tomato_segmentation' / 'weights' / 'best.pt'
-                if yolo_path.exists():
-                    self.segmentation_model = YOLO(str(yolo_path))
-                    print("✅ YOLO cargado")
-                else:
-                    print("❌ Pesos de YOLO no encontrados")
-            except Exception as e:
-                print(f"❌ Error cargando YOLO: {e}")
-        
-        return self.segmentation_model
+        model = self.segmentation_model
+        if model is None:
+            model = self._single_flight(self.SEGMENTATION_KEY, self._load_segmentation)
+        if model is not None:
+            self._touch(self.SEGMENTATION_KEY)
+        return model
     
+    # --- Precarga y warm-up ---
+
+    def warmup(self, name):
+        """Pasa un tensor ficticio por el modelo para trazar el grafo antes del primer usuario"""
+        if name == self.SEGMENTATION_KEY:
+            yolo = self.get_segmentation_model()
+            if yolo is None:
+                raise RuntimeError(self.load_error(name) or "YOLO no disponible")
+            yolo.predict(source=np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+        else:
+            model = self.get_classification_model(name)
+            if model is None:
+                raise RuntimeError(self.load_error(name) or f"{name} no disponible")
+            model.predict_arrays([np.zeros(model.img_size + (3,), dtype=np.float32)])
+
+    def start_preload(self, names):
+        """Carga y calienta los modelos indicados en un hilo de fondo"""
+        if not names:
+            return
+        self.ready.clear()
+        self.preload_status = {name: 'pending' for name in names}
+
+        def run():
+            for name in names:
+                start = time.time()
+                self.preload_status[name] = 'loading'
+                try:
+                    self.warmup(name)
+                    self.preload_status[name] = f"ready ({time.time() - start:.1f}s)"
+                except Exception as e:
+                    self.preload_status[name] = f"error: {e}"
+                    print(f"❌ Precarga de {name} falló: {e}")
+            self.ready.set()
+            print("🔥 Precarga y warm-up completados")
+
+        print(f"🔥 Precargando modelos: {', '.join(names)}")
+        threading.Thread(target=run, name='model-preload', daemon=True).start()
+
+    def readiness(self):
+        return {
+            'ready': self.ready.is_set(),
+            'preload': dict(self.preload_status)
+        }
+
+    def model_version(self, name):
+        """
+        Versión de un modelo sin cargarlo: nombre, tamaño y mtime de sus pesos.
+        None si el modelo no existe en disco.
+        """
+        if name == self.SEGMENTATION_KEY:
+            model_file = MODELS_DIR / 'yolo' / 'tomato_segmentation' / 'weights' / 'best.pt'
+            if not model_file.exists():
+                return None
+        else:
+            path = MODELS_DIR / name
+            if not path.is_dir():
+                return None
+            model_file = next(path.glob("*.h5"), next(path.glob("*.keras"), next(path.glob("*.tflite"), None)))
+            if model_file is None:
+                return None
+            # config.json decide el backend, que también forma parte de la versión
+            config_file = path / 'config.json'
+            if config_file.exists():
+                model_file_stat = model_file.stat()
+                return (f"{model_file.name}:{model_file_stat.st_size}:{model_file_stat.st_mtime_ns}"
+                        f":{config_file.stat().st_mtime_ns}")
+        stat = model_file.stat()
+        return f"{model_file.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def available_variants(self):
+        """Variantes cuantizadas presentes en disco (models/<base>-<variante>/)"""
+        if not MODELS_DIR.exists():
+            return []
+        variants = []
+        for path in sorted(MODELS_DIR.iterdir()):
+            if '-' in path.name and (path / 'config.json').exists() and next(path.glob("*.tflite"), None):
+                variants.append(path.name)
+        return variants
+
     # Helpers para mantener compatibilidad con las rutas viejas
     @property
     def loaded_models_list(self):
@@ -0,0 +1,442 @@
+import json
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from config import RESULTS_FOLDER, Config
+from utils.file_helpers import open_image, wait_for_write, write_in_background, write_atomic
+
+# Paleta BGR para distinguir instancias en la superposición
+PALETTE = [
+    (56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207),
+    (10, 249, 72), (23, 204, 146), (134, 219, 61), (52, 147, 26), (187, 212, 0),
+    (168, 153, 44), (255, 194, 0), (147, 69, 52), (255, 115, 100), (236, 24, 0),
+]
+
+
+def sidecar_path(result_image):
+    """Datos compactos de una segmentación: results/seg_<nombre>.json"""
+    return RESULTS_FOLDER / f"{Path(result_image).stem}.json"
+
+
+def preview_name(result_image, size):
+    return f"{Path(result_image).stem}_{size}.jpg"
+
+
+def segmentation_available(result_image):
+    """La imagen ya renderizada o, al menos, los datos para renderizarla"""
+    return (RESULTS_FOLDER / result_image).exists() or sidecar_path(result_image).exists()
+
+
+def extract_instances(result):
+    """Cajas, clases, confianzas y contornos de un Results de Ultralytics"""
+    instances = []
+    if not result.boxes:
+        return instances
+
+    boxes = result.boxes.xyxy.cpu().numpy()
+    classes = result.boxes.cls.cpu().numpy().astype(int)
+    confidences = result.boxes.conf.cpu().numpy()
+    polygons = result.masks.xy if result.masks is not None else [None] * len(boxes)
+
+    for box, class_id, confidence, polygon in zip(boxes, classes, confidences, polygons):
+        instances.append({
+            'class_id': int(class_id),
+            'class_name': result.names[int(class_id)],
+            'confidence': float(confidence),
+            'box': [round(float(v), 1) for v in box],
+            'polygon': np.round(polygon).astype(int).tolist() if polygon is not None and len(polygon) else []
+        })
+    return instances
+
+
+def rle_to_string(counts):
+    """Compresión de conteos RLE al formato de texto de COCO (igual que pycocotools)"""
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def _interp_axis(start, count, scale, size):
+    """Índices y pesos bilineales de un eje (como F.interpolate con align_corners=False)"""
+    src = np.maximum((np.arange(start, start + count) + 0.5) * scale - 0.5, 0)
+    i0 = np.minimum(np.floor(src).astype(int), size - 1)
+    i1 = np.minimum(i0 + 1, size - 1)
+    return i0, i1, (src - i0).astype(np.float32)
+
+
+def upsample_mask_in_box(mask, image_shape, box):
+    """
+    Lleva una máscara de YOLO (resolución del modelo, con letterbox) a la
+    imagen original, pero solo dentro de su caja: devuelve (máscara booleana
+    local, x0, y0). Nunca se crea la máscara completa H x W.
+    """
+    height, width = image_shape
+    mask_h, mask_w = mask.shape
+    # Quitar el letterbox igual que ultralytics.utils.ops.scale_masks
+    gain = min(mask_h / height, mask_w / width)
+    pad_w, pad_h = (mask_w - width * gain) / 2, (mask_h - height * gain) / 2
+    top, left = int(round(pad_h - 0.1)), int(round(pad_w - 0.1))
+    bottom, right = int(round(mask_h - pad_h + 0.1)), int(round(mask_w - pad_w + 0.1))
+    crop = mask[top:bottom, left:right]
+    crop_h, crop_w = crop.shape
+
+    # La interpolación puede extenderse un píxel de máscara fuera de la caja
+    margin = int(np.ceil(1 / gain)) + 1
+    x0 = max(0, int(np.floor(box[0])) - margin)
+    y0 = max(0, int(np.floor(box[1])) - margin)
+    x1 = min(width, int(np.ceil(box[2])) + margin)
+    y1 = min(height, int(np.ceil(box[3])) + margin)
+    if x1 <= x0 or y1 <= y0:
+        return np.zeros((0, 0), dtype=bool), 0, 0
+
+    ry0, ry1, wy = _interp_axis(y0, y1 - y0, crop_h / height, crop_h)
+    rx0, rx1, wx = _interp_axis(x0, x1 - x0, crop_w / width, crop_w)
+    upper = crop[ry0][:, rx0] * (1 - wx) + crop[ry0][:, rx1] * wx
+    lower = crop[ry1][:, rx0] * (1 - wx) + crop[ry1][:, rx1] * wx
+    local = upper * (1 - wy)[:, None] + lower * wy[:, None]
+    return local > 0.5, x0, y0
+
+
+def box_mask_to_rle(local, x0, y0, image_shape):
+    """RLE de COCO de una máscara local colocada en (x0, y0) de la imagen completa"""
+    height, width = image_shape
+    box_h, box_w = local.shape
+    # Franja de columnas completas (alto de la imagen x ancho de la caja)
+    strip = np.zeros((height, box_w), dtype=bool)
+    strip[y0:y0 + box_h] = local
+    flat = strip.T.ravel()
+    if flat.size == 0:
+        return {'size': [height, width], 'counts': rle_to_string([height * width])}
+
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size]))).tolist()
+    if flat[0]:
+        counts = [0] + counts
+    # Columnas vacías antes y después de la caja
+    counts[0] += x0 * height
+    tail = (width - x0 - box_w) * height
+    if flat[-1]:
+        if tail:
+            counts.append(tail)
+    else:
+        counts[-1] += tail
+    return {'size': [height, width], 'counts': rle_to_string(counts)}
+
+
+def encode_detections(result, encoding='polygon', tolerance=1.0):
+    """
+    Detecciones con geometría compacta: caja xyxy, área en píxeles de la
+    imagen original y la máscara como polígono simplificado o RLE de COCO.
+    """
+    import cv2
+
+    if not result.boxes:
+        return []
+
+    boxes = result.boxes.xyxy.cpu().numpy()
+    classes = result.boxes.cls.cpu().numpy().astype(int)
+    confidences = result.boxes.conf.cpu().numpy()
+    height, width = result.orig_shape
+
+    areas = [None] * len(boxes)
+    rles = [None] * len(boxes)
+    polygons = [None] * len(boxes)
+    if result.masks is not None:
+        mask_data = result.masks.data
+        if encoding == 'rle':
+            # Una máscara cada vez y solo dentro de su caja: con fotos de 4000 px
+            # las N máscaras completas en float32 no caben en memoria
+            for i in range(len(boxes)):
+                local, x0, y0 = upsample_mask_in_box(
+                    mask_data[i].float().cpu().numpy(), (height, width), boxes[i]
+                )
+                areas[i] = int(local.sum())
+                rles[i] = box_mask_to_rle(local, x0, y0, (height, width))
+        else:
+            # Área a resolución de la máscara, reescalada por la ganancia del letterbox
+            mask_h, mask_w = mask_data.shape[1:]
+            gain = min(mask_h / height, mask_w / width)
+            areas = (mask_data.sum(dim=(1, 2)).cpu().numpy() / (gain * gain)).round().astype(int).tolist()
+            if encoding == 'polygon':
+                for i, polygon in enumerate(result.masks.xy):
+                    if len(polygon) >= 3:
+                        simplified = cv2.approxPolyDP(polygon.astype(np.float32), tolerance, True)
+                        polygons[i] = np.round(simplified.reshape(-1, 2), 1).tolist()
+                    else:
+                        polygons[i] = []
+
+    detections = []
+    for i, (box, class_id, confidence) in enumerate(zip(boxes, classes, confidences)):
+        detection = {
+            'class_id': int(class_id),
+            'class_name': result.names[int(class_id)],
+            'confidence': float(confidence),
+            'box': [round(float(v), 1) for v in box],
+            'area': int(areas[i]) if areas[i] is not None else None
+        }
+        if encoding == 'polygon' and polygons[i] is not None:
+            detection['polygon'] = polygons[i]
+        elif encoding == 'rle' and rles[i] is not None:
+            detection['rle'] = rles[i]
+        detections.append(detection)
+    return detections
+
+
+def crop_instances(img_rgb, result, masked=False, padding=0.0):
+    """
+    Recortes de cada instancia detectada. Sin máscara son vistas del array
+    original (no se copia nada ni se escribe en disco); con máscara se
+    genera un array nuevo por recorte con el fondo a 0.
+    Devuelve una lista de (índice de detección, recorte).
+    """
+    import cv2
+
+    crops = []
+    if not result.boxes:
+        return crops
+
+    height, width = img_rgb.shape[:2]
+    boxes = result.boxes.xyxy.cpu().numpy()
+    polygons = result.masks.xy if (masked and result.masks is not None) else None
+
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        pad_x, pad_y = (x2 - x1) * padding, (y2 - y1) * padding
+        left, top = max(0, int(x1 - pad_x)), max(0, int(y1 - pad_y))
+        right, bottom = min(width, int(np.ceil(x2 + pad_x))), min(height, int(np.ceil(y2 + pad_y)))
+        if right - left < 2 or bottom - top < 2:
+            continue
+
+        crop = img_rgb[top:bottom, left:right]
+        if polygons is not None and len(polygons[i]) >= 3:
+            mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+            points = np.round(polygons[i] - [left, top]).astype(np.int32)
+            cv2.fillPoly(mask, [points], 1)
+            crop = crop * mask[:, :, None]
+        crops.append((i, crop))
+    return crops
+
+
+# --- Inferencia por mosaicos (imágenes de alta resolución) ---
+
+def decode_for_tiling(source, max_side):
+    """
+    Decodifica como mucho a max_side píxeles de lado (en JPEG, draft reduce
+    ya en el decodificador), así la memoria no depende de la resolución
+    original. Devuelve (imagen BGR, (alto, ancho) original, escala a original).
+    """
+    img = open_image(source)
+    orig_w, orig_h = img.size
+    if max(orig_w, orig_h) > max_side:
+        ratio = max_side / max(orig_w, orig_h)
+        img.draft('RGB', (int(np.ceil(orig_w * ratio)), int(np.ceil(orig_h * ratio))))
+    img = img.convert('RGB')
+    if max(img.size) > max_side:
+        ratio = max_side / max(img.size)
+        img = img.resize((max(1, round(img.width * ratio)), max(1, round(img.height * ratio))), Image.BILINEAR)
+    scale = orig_w / img.width
+    return np.ascontiguousarray(np.asarray(img)[:, :, ::-1]), (orig_h, orig_w), scale
+
+
+def tile_origins(length, tile_size, stride):
+    """Inicios de los mosaicos en un eje; el último queda pegado al borde"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+
+def merge_nms(boxes, scores, classes, iou_threshold, ios_threshold):
+    """
+    NMS por clase para unir detecciones de mosaicos vecinos. Además del IoU
+    se usa la intersección sobre la caja menor (IoS): un tomate cortado por
+    el borde de un mosaico queda contenido en su detección completa del
+    mosaico vecino aunque el IoU sea bajo. En ese caso se conserva la caja
+    mayor (la completa), aunque el fragmento tenga más confianza.
+    """
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    def overlaps(i, rest):
+        x1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-6)
+        ios = inter / np.maximum(np.minimum(areas[i], areas[rest]), 1e-6)
+        same_class = classes[rest] == classes[i]
+        contained = same_class & (ios > ios_threshold)
+        return same_class & (iou > iou_threshold) | contained, contained
+
+    order = np.argsort(-scores)
+    keep = []
+    while order.size:
+        i = order[0]
+        rest = order[1:]
+        suppressed, contained = overlaps(i, rest)
+        bigger = rest[contained & (areas[rest] > areas[i])]
+        if bigger.size:
+            # i es un fragmento dentro de una detección mayor: gana la mayor
+            i = bigger[np.argmax(areas[bigger])]
+            rest = order[order != i]
+            suppressed, _ = overlaps(i, rest)
+        keep.append(i)
+        order = rest[~suppressed]
+    return keep
+
+
+def tiled_segment(yolo, source, conf, tolerance=1.0):
+    """
+    Segmenta por mosaicos solapados: los mosaicos van a YOLO en lotes,
+    las detecciones se llevan a coordenadas de la imagen original y se
+    unen con merge_nms. Devuelve (instancias, forma original, estadísticas).
+    """
+    import cv2
+
+    tile_size = Config.SEG_TILE_SIZE
+    img_bgr, orig_shape, scale = decode_for_tiling(source, Config.SEG_TILE_MAX_SIDE)
+    height, width = img_bgr.shape[:2]
+    stride = max(1, int(tile_size * (1 - Config.SEG_TILE_OVERLAP)))
+    origins = [(x, y) for y in tile_origins(height, tile_size, stride)
+               for x in tile_origins(width, tile_size, stride)]
+
+    boxes, scores, classes, polygons = [], [], [], []
+    names = {}
+    batch_size = max(1, Config.SEG_TILE_MAX_BATCH)
+    for offset in range(0, len(origins), batch_size):
+        group = origins[offset:offset + batch_size]
+        tiles = [img_bgr[y:y + tile_size, x:x + tile_size] for x, y in group]
+        results = yolo.predict(source=tiles, conf=conf, imgsz=tile_size, save=False, verbose=False)
+        for (x, y), result in zip(group, results):
+            names = result.names
+            if not result.boxes:
+                continue
+            boxes.append(result.boxes.xyxy.cpu().numpy() + [x, y, x, y])
+            scores.append(result.boxes.conf.cpu().numpy())
+            classes.append(result.boxes.cls.cpu().numpy().astype(int))
+            tile_polygons = result.masks.xy if result.masks is not None else [np.zeros((0, 2))] * len(result.boxes)
+            polygons.extend(polygon + [x, y] for polygon in tile_polygons)
+
+    stats = {'tiles': len(origins), 'tile_size': tile_size, 'decode_scale': round(scale, 3), 'candidates': 0}
+    if not boxes:
+        return [], orig_shape, stats
+
+    boxes = np.concatenate(boxes)
+    scores = np.concatenate(scores)
+    classes = np.concatenate(classes)
+    stats['candidates'] = len(boxes)
+    keep = merge_nms(boxes, scores, classes, Config.SEG_TILE_NMS_IOU, Config.SEG_TILE_NMS_IOS)
+
+    instances = []
+    for i in keep:
+        polygon = (polygons[i] * scale).astype(np.float32)
+        box = boxes[i] * scale
+        if len(polygon) >= 3:
+            area = float(cv2.contourArea(polygon))
+            polygon = cv2.approxPolyDP(polygon, tolerance, True).reshape(-1, 2)
+        else:
+            area = float((box[2] - box[0]) * (box[3] - box[1]))
+        instances.append({
+            'class_id': int(classes[i]),
+            'class_name': names.get(int(classes[i]), str(classes[i])),
+            'confidence': float(scores[i]),
+            'box': [round(float(v), 1) for v in box],
+            'area': int(round(area)),
+            'polygon': np.round(polygon, 1).tolist()
+        })
+    return instances, orig_shape, stats
+
+
+def save_segmentation(result_image, source_path, source_data, image_shape, instances):
+    """
+    Guarda lo mínimo para renderizar después: el JSON con las instancias y
+    una referencia a la imagen original. Si los uploads no se persisten, se
+    guarda una copia del original junto al JSON (en segundo plano).
+    """
+    if source_path is None:
+        # Sin extensión: PIL detecta el formato por el contenido
+        source_path = RESULTS_FOLDER / f"src_{Path(result_image).stem}"
+        write_in_background(source_path, source_data)
+
+    sidecar = {
+        'source': str(source_path),
+        'shape': [int(image_shape[0]), int(image_shape[1])],
+        'instances': instances
+    }
+    write_atomic(sidecar_path(result_image), json.dumps(sidecar).encode('utf-8'))
+
+
+def render_overlay(sidecar, max_size=None):
+    """Dibuja máscaras, cajas y etiquetas sobre el original (BGR), opcionalmente reducido"""
+    import cv2
+
+    wait_for_write(sidecar['source'])
+    img = open_image(sidecar['source'])
+    height, width = sidecar['shape']
+    scale = 1.0
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        # En JPEG, draft decodifica directamente a menor resolución
+        img.draft('RGB', (int(width * scale), int(height * scale)))
+    img = img.convert('RGB')
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if img.size != target:
+        img = img.resize(target, Image.BILINEAR)
+    canvas = np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+
+    # Máscaras: todas en una capa y una sola mezcla alfa
+    overlay = canvas.copy()
+    for i, inst in enumerate(sidecar['instances']):
+        if inst['polygon']:
+            points = (np.asarray(inst['polygon'], dtype=np.float32) * scale).round().astype(np.int32)
+            cv2.fillPoly(overlay, [points], PALETTE[i % len(PALETTE)])
+    canvas = cv2.addWeighted(overlay, 0.5, canvas, 0.5, 0)
+
+    line = max(1, round(max(target) / 400))
+    for i, inst in enumerate(sidecar['instances']):
+        color = PALETTE[i % len(PALETTE)]
+        x1, y1, x2, y2 = (int(round(v * scale)) for v in inst['box'])
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, line)
+        label = f"{inst['class_name']} {inst['confidence']:.2f}"
+        cv2.putText(canvas, label, (x1, max(y1 - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.4 * line, color, max(1, line // 2), cv2.LINE_AA)
+    return canvas
+
+
+def encode_jpeg(img_bgr):
+    import cv2
+    ok, encoded = cv2.imencode('.jpg', img_bgr, [cv2.IMWRITE_JPEG_QUALITY, Config.SEG_JPEG_QUALITY])
+    if not ok:
+        raise RuntimeError('No se pudo codificar la imagen segmentada')
+    return encoded.tobytes()
+
+
+def get_rendered_image(result_image, size=None):
+    """
+    Ruta de la imagen renderizada; la genera la primera vez que se pide y la
+    deja cacheada en disco. Devuelve None si no hay datos de esa segmentación.
+    """
+    name = preview_name(result_image, size) if size else result_image
+    path = RESULTS_FOLDER / name
+    if path.exists():
+        return path
+
+    sidecar_file = sidecar_path(result_image)
+    if not sidecar_file.exists():
+        return None
+    sidecar = json.loads(sidecar_file.read_text())
+
+    # Dos primeras peticiones simultáneas renderizan ambas; gana el último rename
+    write_atomic(path, encode_jpeg(render_overlay(sidecar, max_size=size)))
+    return path
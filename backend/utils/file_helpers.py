@@ -1,15 +1,97 @@
+import hashlib
+import io
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from PIL import Image
 from config import UPLOAD_FOLDER, Config
 
+# Escrituras de los originales fuera del camino de la petición
+_persist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-writer')
+_pending_writes = {}
+_pending_lock = threading.Lock()
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
-def save_uploaded_file(file):
+def build_upload_path(original_filename):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return UPLOAD_FOLDER / f"{timestamp}_{original_filename}"
+
+def uploaded_file_size(file):
+    """Tamaño en bytes de un archivo subido sin leerlo a memoria"""
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def read_uploaded_file(file):
+    """
+    Lee el archivo subido a memoria sin tocar el disco.
+    Devuelve (ruta destino en uploads/, bytes) o (None, None) si el tipo no es válido.
+    """
     if file and allowed_file(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{file.filename}"
-        filepath = UPLOAD_FOLDER / filename
-        file.save(str(filepath))
-        return filepath
-    return None
\ No newline at end of file
+        return build_upload_path(file.filename), file.read()
+    return None, None
+
+def _write_file(filepath, data):
+    try:
+        filepath.write_bytes(data)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar {filepath.name}: {e}")
+    finally:
+        with _pending_lock:
+            _pending_writes.pop(str(filepath), None)
+
+def write_in_background(filepath, data):
+    """Escribe bytes en disco sin bloquear la petición"""
+    with _pending_lock:
+        _pending_writes[str(filepath)] = _persist_executor.submit(_write_file, filepath, data)
+
+def wait_for_write(filepath, timeout=5.0):
+    """Si filepath todavía se está escribiendo en segundo plano, espera a que termine"""
+    with _pending_lock:
+        future = _pending_writes.get(str(filepath))
+    if future is not None:
+        future.result(timeout=timeout)
+
+def persist_upload(filepath, data):
+    """
+    Guarda el original en segundo plano (PERSIST_UPLOADS=false lo desactiva).
+    Devuelve la ruta como str para el registro en BD, o None si no se guarda.
+    """
+    if not Config.PERSIST_UPLOADS:
+        return None
+    write_in_background(filepath, data)
+    return str(filepath)
+
+def unique_temp_path(filepath):
+    """Temporal propio de este escritor (pid + uuid) junto a filepath"""
+    return filepath.with_name(f"{filepath.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+
+def write_atomic(filepath, data):
+    """
+    Escribe en un temporal propio y renombra: dos escritores del mismo
+    archivo no se pisan y nunca queda uno a medias con el nombre final.
+    """
+    tmp = unique_temp_path(filepath)
+    try:
+        tmp.write_bytes(data)
+        tmp.replace(filepath)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def hash_bytes(data):
+    """SHA-256 de los bytes subidos"""
+    return hashlib.sha256(data).hexdigest()
+
+def open_image(source):
+    """Abre una imagen desde bytes en memoria o desde una ruta"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(str(source))